@@ -1,74 +1,77 @@
 import argparse
+import os
 import subprocess
 import sys
 import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import cv2
-import exchange_calendars as xcals
 import numpy as np
-import pandas as pd
 
-from config import WIDTH, HEIGHT, NUM_PIXELS, DATA_DIR as OUTPUT_DIR
+from config import WIDTH, HEIGHT
+from frames import FRAMES_DIR, Frames
+from sessions import REBALANCE_NS, Sessions
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--start-date", required=True)
 parser.add_argument("--first-period", type=int, default=1)
+# Store frames bit-packed (thresholded at half intensity) instead of as uint8.
+parser.add_argument("--bits", action="store_true")
+parser.add_argument("--workers", type=int, default=os.cpu_count())
 args = parser.parse_args()
 
 print(f"Using W = {WIDTH}, H = {HEIGHT}")
 print(f"Start date = {args.start_date}, first period = {args.first_period}")
 
+sessions = Sessions.load(args.start_date, "2025-12-31").between(args.start_date, "2025-12-31")
+grid = sessions.rebalance_grid().periods
+# Skip the first day's periods before --first-period.
+first_day_periods = (sessions.close_ns[0] - sessions.open_ns[0]) // REBALANCE_NS - 1 if len(sessions) else 0
+timestamps = grid[min(max(args.first_period - 1, 0), first_day_periods):]
+print(f"{len(timestamps)} rebalance periods to fill")
+
+
+def convert(pixels, i, frame):
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    pixels[i] = cv2.resize(gray, (WIDTH, HEIGHT), interpolation=cv2.INTER_AREA)
+
+
 with tempfile.TemporaryDirectory() as tmpdir:
     subprocess.run([
         sys.executable, "-m", "yt_dlp", "-f", "bestvideo[vcodec^=avc1]/best",
         "-o", f"{tmpdir}/video.%(ext)s", "--no-playlist", "-q", "--no-warnings",
         "https://www.youtube.com/watch?v=FtutLA63Cp8"
     ], check=True)
+    video = str(next(Path(tmpdir).glob("video.*")))
 
-    cap = cv2.VideoCapture(str(next(Path(tmpdir).glob("video.*"))))
-    frames = []
-    while (ret := cap.read())[0]:
-        gray = cv2.cvtColor(ret[1], cv2.COLOR_BGR2GRAY)
-        resized = cv2.resize(gray, (WIDTH, HEIGHT), interpolation=cv2.INTER_AREA)
-        frames.append((resized.astype(np.float32) / 255.0).flatten())
+    # Frames are decoded in order on this thread, so frame i always lands on
+    # period i, and decoding stops once every period has one. (Seeking to
+    # split the decode isn't safe: the container's frame count and frame seeks
+    # are only approximate for many codecs.) The grayscale conversion and
+    # resize of each frame run on `--workers` threads, which OpenCV lets run in
+    # parallel, writing straight into the output array while the next frames
+    # decode. At most a few full-size frames per worker wait in between.
+    pixels = np.empty((len(timestamps), HEIGHT, WIDTH), dtype=np.uint8)
+    cap = cv2.VideoCapture(video)
+    n_frames = 0
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        while n_frames < len(timestamps) and (ret := cap.read())[0]:
+            if len(pending) >= 4 * args.workers:
+                pending.popleft().result()
+            pending.append(executor.submit(convert, pixels, n_frames, ret[1]))
+            n_frames += 1
+        for future in pending:
+            future.result()
     cap.release()
+    print(f"Extracted {n_frames} frames from video")
 
-print(f"Extracted {len(frames)} frames from video")
-
-xnas = xcals.get_calendar("XNAS")
-schedule = xnas.schedule.loc[args.start_date:"2025-12-31"]
-
-timestamps = []
-first_day = True
-for _, row in schedule.iterrows():
-    t = row["open"] + pd.Timedelta(minutes=15)
-    end = row["close"] - pd.Timedelta(minutes=15)
-    period_num = 1
-    while t <= end:
-        if first_day and period_num < args.first_period:
-            period_num += 1
-            t += pd.Timedelta(minutes=15)
-            continue
-        timestamps.append(t)
-        period_num += 1
-        t += pd.Timedelta(minutes=15)
-    first_day = False
-
-min_len = min(len(frames), len(timestamps))
-timestamps = timestamps[:min_len]
-frames = frames[:min_len]
-print(f"Aligned to {min_len} frames/timestamps")
-
-data = np.stack(frames)
-df = pd.DataFrame({
-    "timestamp": timestamps,
-    **{f"p{i}": data[:, i] for i in range(NUM_PIXELS)}
-})
-
-output_file = OUTPUT_DIR / "bad_apple_frames.parquet"
-df.to_parquet(output_file)
+    frames = Frames(timestamps[:n_frames], pixels[:n_frames])
+    frames.save(FRAMES_DIR, bits=args.bits)
 
-print(f"Saved {len(df)} frames to {output_file}")
-print(f"First timestamp: {df['timestamp'].iloc[0]}")
-print(f"Last timestamp:  {df['timestamp'].iloc[-1]}")
+index = frames.timestamp_index()
+print(f"Saved {len(frames)} frames to {FRAMES_DIR}")
+print(f"First timestamp: {index[0]}")
+print(f"Last timestamp:  {index[-1]}")
@@ -2,6 +2,7 @@ import databento as db
 import pandas as pd
 
 from config import DATA_DIR as OUTPUT_DIR
+from frames import Frames
 
 RIC_SUFFIX = {
     "XNAS": ".OQ", "XNYS": ".N", "ARCX": ".P", "BATS": ".Z",
@@ -16,9 +17,9 @@ if env_file.exists():
             k, v = line.split("=", 1)
             os.environ[k.strip()] = v.strip()
 
-frames = pd.read_parquet(OUTPUT_DIR / "bad_apple_frames.parquet", columns=["timestamp"])
-start_date = frames["timestamp"].min().strftime("%Y-%m-%d")
-end_date = (frames["timestamp"].max() + pd.Timedelta(days=1)).strftime("%Y-%m-%d")
+frame_times = Frames.load().timestamp_index()
+start_date = frame_times.min().strftime("%Y-%m-%d")
+end_date = (frame_times.max() + pd.Timedelta(days=1)).strftime("%Y-%m-%d")
 print(f"Date range from frames: {start_date} to {end_date}")
 
 client = db.Historical()
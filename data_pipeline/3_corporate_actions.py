@@ -1,163 +1,184 @@
+import argparse
 import json
-import os
-import tempfile
-import time
-from collections import defaultdict
 
-import lseg.data as ld
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
 
-from config import DATA_DIR, get_s3_client, get_s3_bucket
+from ca_store import CorporateActionsStore
+from config import DATA_DIR, get_store
+from lseg_client import MAX_BATCH, BatchFetcher, get_lseg_client
 
 import warnings  # LSEG fix your warnings please and thank you
 warnings.filterwarnings("ignore", category=FutureWarning)
 
 INPUT_FILE = DATA_DIR / "databento_universe_rics.csv"
-FRAMES_FILE = DATA_DIR / "bad_apple_frames.parquet"
 
 # Dammit LSEG why do you filter corporate actions data based on the
 # ANNOUNCEMENT date??
 START_DATE = "2020-01-01"
 END_DATE = "2026-01-01"
-BATCH_SIZE = 100
-MAX_RETRIES = 3
 
-
-def fetch_with_retry(func, desc="request"):
-    for attempt in range(MAX_RETRIES):
-        try:
-            df = func()
-            return df if df is not None and not df.empty else None
-        except Exception as e:
-            wait = 2 ** (attempt + 1)
-            if attempt < MAX_RETRIES - 1:
-                tqdm.write(f"Retry {attempt + 1}/{MAX_RETRIES} for {desc} after {wait}s: {e}")
-                time.sleep(wait)
-            else:
-                tqdm.write(f"FAILED {desc} after {MAX_RETRIES} retries: {e}")
-    return None
+DIVIDEND_FIELDS = [
+    "TR.DivExDate", "TR.DivPayDate", "TR.DivRecordDate",
+    "TR.DivUnadjustedGross", "TR.DivAdjustedGross", "TR.DivType", "TR.DivCurrency"
+]
+CAPITAL_CHANGE_FIELDS = [
+    "TR.CAExDate", "TR.CAEffectiveDate", "TR.CAAdjustmentFactor", "TR.CAAdjustmentType",
+    "TR.CAAnnouncementDate", "TR.CATermsOldShares", "TR.CATermsNewShares"
+]
+# Refreshes re-query from this long before a RIC's watermark, in case LSEG
+# posts an announcement late.
+REFRESH_OVERLAP = pd.Timedelta(days=7)
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--workers", type=int, default=8)
+parser.add_argument("--batch-size", type=int, default=MAX_BATCH)
+# RICs fetched (or found uncovered) longer ago than this are refreshed.
+parser.add_argument("--max-age-days", type=float, default=7)
+# Refetch every RIC's full history, ignoring the watermarks.
+parser.add_argument("--full", action="store_true")
+args = parser.parse_args()
+
+
+def fetch_all(fetcher, rics, fields, desc, parameters=None):
+    with tqdm(total=len(rics), desc=desc) as progress:
+        fetcher.progress = progress
+        dfs = fetcher.fetch(rics, fields, parameters)
+    fetcher.progress = None
+    return pd.concat(dfs, ignore_index=True) if dfs else None
+
+
+def fetch_dividends(fetcher, rics, start_date):
+    df = fetch_all(fetcher, rics, DIVIDEND_FIELDS, "Dividends", parameters={"SDate": start_date, "EDate": END_DATE})
+    if df is None:
+        return None
+    df = df.rename(columns={
+        "Instrument": "ric", "Dividend Ex Date": "ex_date", "Dividend Pay Date": "pay_date",
+        "Dividend Record Date": "record_date", "Gross Dividend Amount": "gross_amount",
+        "Adjusted Gross Dividend Amount": "adjusted_amount", "Dividend Type": "div_type"})
+    return df.dropna(subset=["ex_date"])
+
+
+def fetch_capital_changes(fetcher, rics, start_date):
+    df = fetch_all(fetcher, rics, CAPITAL_CHANGE_FIELDS, "Capital Changes",
+                   parameters={"SDate": start_date, "EDate": END_DATE})
+    if df is None:
+        return None
+    df = df.rename(columns={
+        "Instrument": "ric", "Capital Change Ex Date": "ex_date",
+        "Capital Change Effective Date": "effective_date",
+        "Adjustment Factor": "adjustment_factor", "Adjustment Type": "adjustment_type",
+        "Capital Change Announcement Date": "announcement_date",
+        "Terms Old Shares": "terms_old_shares", "Terms New Shares": "terms_new_shares"})
+
+    # LSEG returns a row for every queried symbol, even those with no
+    # capital changes. Those placeholder rows have all NaN values, so
+    # we drop rows where BOTH ex_date and effective_date are missing.
+    return df.dropna(subset=["ex_date", "effective_date"], how="all")
+
+
+def symbols_of(rics):
+    return rics.str.rsplit(".", n=1).str[0]
+
+
+# {symbol: [{"date", "factor", "date_type"}, ...]} from capital changes,
+# dated by ex date, or effective date where there's no ex date.
+def build_splits(capital_changes):
+    if capital_changes.empty:
+        return {}
+    cc = capital_changes
+    cc = cc[cc["adjustment_factor"].notna() & ~cc["adjustment_factor"].isin([0, 1])]
+    on_ex = cc["ex_date"].notna()
+    splits = pd.DataFrame({
+        "symbol": symbols_of(cc["ric"]),
+        "date": cc["ex_date"].where(on_ex, cc["effective_date"]).dt.strftime("%Y-%m-%d"),
+        "factor": cc["adjustment_factor"].astype(float),
+        "date_type": np.where(on_ex, "ex_date", "effective_date"),
+    })[on_ex | cc["effective_date"].notna()]
+    return {sym: group[["date", "factor", "date_type"]].to_dict("records")
+            for sym, group in splits.groupby("symbol", sort=False)}
+
+
+# {pay date: {symbol: {"amount", "ex_date"}}} from dividends with a positive
+# gross amount and a pay date; the last one wins for a symbol paying twice on
+# the same day.
+def build_dividends(dividends):
+    if dividends.empty:
+        return {}
+    dv = dividends
+    dv = dv[dv["gross_amount"].notna() & (dv["gross_amount"] > 0) & dv["pay_date"].notna()]
+    rows = pd.DataFrame({
+        "pay_date": dv["pay_date"].dt.strftime("%Y-%m-%d"),
+        "symbol": symbols_of(dv["ric"]),
+        "amount": dv["gross_amount"].astype(float),
+        "ex_date": dv["ex_date"].dt.strftime("%Y-%m-%d"),
+    }).drop_duplicates(["pay_date", "symbol"], keep="last")
+    return {pay_date: {sym: {"amount": amount, "ex_date": ex_date}
+                       for sym, amount, ex_date in zip(group["symbol"], group["amount"].tolist(), group["ex_date"])}
+            for pay_date, group in rows.groupby("pay_date", sort=False)}
 
 
 rics = pd.read_csv(INPUT_FILE)["RIC"].tolist()
 
-all_dividends = []
-all_capital_changes = []
-lseg_covered_rics = set()
-
-with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as f:
-    json.dump({
-        "sessions": {"platform": {"rdp": {
-            "app-key": os.getenv("LSEG_APP_KEY") or os.getenv("REFINITIV_API_KEY"),
-            "username": os.getenv("LSEG_USERNAME") or os.getenv("REFINITIV_USERNAME"),
-            "password": os.getenv("LSEG_PASSWORD") or os.getenv("REFINITIV_PASSWORD"),
-            "signon_control": True,
-        }}},
-        "logs": {"level": "warning"},
-    }, f)
-    config_path = f.name
-ld.load_config(config_path)
-os.unlink(config_path)
-ld.open_session(name="platform.rdp")
+ca = CorporateActionsStore()
+now = pd.Timestamp.now(tz="UTC")
+cutoff = now if args.full else now - pd.Timedelta(days=args.max_age_days)
+
+client = get_lseg_client()
+fetcher = BatchFetcher(client, workers=args.workers, batch_size=args.batch_size)
+client.open()
 
 try:
-    print("Checking LSEG coverage...")
-    for i in tqdm(range(0, len(rics), BATCH_SIZE), desc="Coverage"):
-        batch = rics[i:i+BATCH_SIZE]
-        df = fetch_with_retry(lambda: ld.get_data(batch, ["TR.CommonName"]), f"coverage batch {i//BATCH_SIZE + 1}")
-        if df is not None:
-            covered = df[df["Company Common Name"].notna()]["Instrument"].tolist()
-            lseg_covered_rics.update(covered)
-
-    print(f"LSEG covers {len(lseg_covered_rics)} of {len(rics)} RICs")
-    covered_rics = sorted(lseg_covered_rics)
-
-    print("Fetching corporate actions for covered symbols...")
-    for i in tqdm(range(0, len(covered_rics), BATCH_SIZE), desc="Corp Actions"):
-        batch = covered_rics[i:i+BATCH_SIZE]
-
-        df = fetch_with_retry(lambda: ld.get_data(batch, [
-            "TR.DivExDate", "TR.DivPayDate", "TR.DivRecordDate",
-            "TR.DivUnadjustedGross", "TR.DivAdjustedGross", "TR.DivType", "TR.DivCurrency"
-        ], parameters={"SDate": START_DATE, "EDate": END_DATE}), f"dividends batch {i//BATCH_SIZE + 1}")
-        if df is not None:
-            df = df.rename(columns={
-                "Instrument": "ric", "Dividend Ex Date": "ex_date", "Dividend Pay Date": "pay_date",
-                "Dividend Record Date": "record_date", "Gross Dividend Amount": "gross_amount",
-                "Adjusted Gross Dividend Amount": "adjusted_amount", "Dividend Type": "div_type"})
-            df = df.dropna(subset=["ex_date"])
-            if not df.empty:
-                all_dividends.append(df)
-
-        df = fetch_with_retry(lambda: ld.get_data(batch, [
-            "TR.CAExDate", "TR.CAEffectiveDate", "TR.CAAdjustmentFactor", "TR.CAAdjustmentType",
-            "TR.CAAnnouncementDate", "TR.CATermsOldShares", "TR.CATermsNewShares"
-        ], parameters={"SDate": START_DATE, "EDate": END_DATE}), f"capital changes batch {i//BATCH_SIZE + 1}")
-        if df is not None:
-            df = df.rename(columns={
-                "Instrument": "ric", "Capital Change Ex Date": "ex_date",
-                "Capital Change Effective Date": "effective_date",
-                "Adjustment Factor": "adjustment_factor", "Adjustment Type": "adjustment_type",
-                "Capital Change Announcement Date": "announcement_date",
-                "Terms Old Shares": "terms_old_shares", "Terms New Shares": "terms_new_shares"})
-
-            # LSEG returns a row for every queried symbol, even those with no
-            # capital changes. Those placeholder rows have all NaN values, so
-            # we drop rows where BOTH ex_date and effective_date are missing.
-            df = df.dropna(subset=["ex_date", "effective_date"], how="all")
-            if not df.empty:
-                all_capital_changes.append(df)
+    to_check = ca.needs_coverage(rics, cutoff)
+    print(f"Checking LSEG coverage for {len(to_check)} new or uncovered RICs...")
+    if to_check:
+        df = fetch_all(fetcher, to_check, ["TR.CommonName"], "Coverage")
+        covered = set(df[df["Company Common Name"].notna()]["Instrument"]) if df is not None else set()
+        failed = set(fetcher.failed)
+        ca.set_coverage([r for r in to_check if r not in failed], covered, now)
+
+    groups = ca.needs_actions(rics, cutoff)
+    print(f"Fetching corporate actions for {sum(len(g) for g in groups.values())} new or stale covered RICs...")
+    for since, group in groups.items():
+        start_date = START_DATE if since is None or args.full else \
+            max(START_DATE, (since - REFRESH_OVERLAP).strftime("%Y-%m-%d"))
+        # Queries end at END_DATE, so a refresh starting after it has nothing
+        # to ask for (and LSEG would get an inverted window).
+        if start_date >= END_DATE:
+            ca.set_actions_through(group, now)
+            continue
+        ca.merge("dividends", fetch_dividends(fetcher, group, start_date))
+        failed = set(fetcher.failed)
+        ca.merge("capital_changes", fetch_capital_changes(fetcher, group, start_date))
+        failed |= set(fetcher.failed)
+        ca.set_actions_through([r for r in group if r not in failed], now)
 finally:
-    ld.close_session()
-
-dividends_df = pd.concat(all_dividends, ignore_index=True) if all_dividends else pd.DataFrame()
-capital_changes_df = pd.concat(all_capital_changes, ignore_index=True) if all_capital_changes else pd.DataFrame()
-
-print(f"Fetched {len(dividends_df)} dividends, {len(capital_changes_df)} capital changes")
-
-splits_dict = {}
-for _, row in capital_changes_df.iterrows():
-    sym = row['ric'].rsplit('.', 1)[0]
-    adj = row['adjustment_factor']
-    if pd.isna(adj) or adj == 0 or adj == 1:
-        continue
-
-    if pd.notna(row['ex_date']):
-        date_str = str(row['ex_date'].date())
-        date_type = "ex_date"
-    elif pd.notna(row['effective_date']):
-        date_str = str(row['effective_date'].date())
-        date_type = "effective_date"
-    else:
-        continue
-
-    if sym not in splits_dict:
-        splits_dict[sym] = []
-    splits_dict[sym].append({
-        "date": date_str,
-        "factor": adj,
-        "date_type": date_type
-    })
-
-divs_by_date = defaultdict(dict)
-for _, row in dividends_df.iterrows():
-    if pd.isna(row['gross_amount']) or row['gross_amount'] <= 0 or pd.isna(row['pay_date']):
-        continue
-    sym = row['ric'].rsplit('.', 1)[0]
-    divs_by_date[str(row['pay_date'].date())][sym] = {
-        'amount': row['gross_amount'],
-        'ex_date': str(row['ex_date'].date())
-    }
+    client.close()
+    ca.save()
+
+stats = fetcher.stats
+print(f"{stats['requests']} requests for {stats['rics']} RICs in {stats['seconds']:.1f}s "
+      f"({stats['rics'] / max(stats['seconds'], 1e-9):.0f} RICs/s), {stats['rate_limited']} rate-limited, "
+      f"{stats['retries']} retries, {stats['failed']} RICs failed")
+
+lseg_covered_rics = ca.covered(rics)
+print(f"LSEG covers {len(lseg_covered_rics)} of {len(rics)} RICs")
+dividends_df = ca.table("dividends", lseg_covered_rics)
+capital_changes_df = ca.table("capital_changes", lseg_covered_rics)
+
+print(f"Stored {len(dividends_df)} dividends, {len(capital_changes_df)} capital changes")
+
+splits_dict = build_splits(capital_changes_df)
+divs_by_date = build_dividends(dividends_df)
 
 lseg_symbols = sorted(set(ric.rsplit('.', 1)[0] for ric in lseg_covered_rics))
 pd.DataFrame({"symbol": lseg_symbols}).to_csv(DATA_DIR / "lseg_covered_symbols.csv", index=False)
 print(f"Saved {len(lseg_symbols)} LSEG-covered symbols to lseg_covered_symbols.csv")
 
-s3 = get_s3_client()
-bucket = get_s3_bucket()
-
-s3.put_object(Bucket=bucket, Key="config/splits_lseg.json", Body=json.dumps(splits_dict))
-s3.put_object(Bucket=bucket, Key="config/dividends.json", Body=json.dumps(dict(divs_by_date)))
+store = get_store()
+store.put("config/splits_lseg.json", json.dumps(splits_dict))
+store.put("config/dividends.json", json.dumps(divs_by_date))
 
 total_splits = sum(len(v) for v in splits_dict.values())
 ex_date_count = sum(1 for v in splits_dict.values() for s in v if s["date_type"] == "ex_date")
@@ -1,22 +1,31 @@
 import argparse
+import hashlib
 import json
 import os
+import threading
+import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import databento as db
 import requests
+from botocore.exceptions import BotoCoreError, ClientError
 
-from config import get_s3_client, get_s3_bucket
+from config import MULTIPART_PART_SIZE, get_store
+
+CHUNK_SIZE = 1024**2
+MAX_ATTEMPTS = 3
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--job-id", required=True)
 parser.add_argument("--prefix", required=True)
-parser.add_argument("--workers", type=int, default=4)
+# Nothing touches local disk, so this is bounded by bandwidth, not /tmp: each
+# worker holds at most one multipart part (MULTIPART_PART_SIZE) in memory.
+parser.add_argument("--workers", type=int, default=32)
 args = parser.parse_args()
+auth = (os.environ["DATABENTO_API_KEY"], "")
 
 client = db.Historical(os.environ["DATABENTO_API_KEY"])
-s3 = get_s3_client()
-bucket = get_s3_bucket()
+store = get_store()
 
 # Databento why don't you have a .get_job() method?
 job = next((j for j in client.batch.list_jobs() if j["id"] == args.job_id), None)
@@ -32,31 +41,92 @@ print(f"Files to ingest: {len(data_files)}")
 
 symbology_file = files_by_name.get("symbology.json")
 if symbology_file:
-    resp = requests.get(symbology_file["urls"]["https"], auth=(os.environ["DATABENTO_API_KEY"], ""))
+    resp = requests.get(symbology_file["urls"]["https"], auth=auth)
     raw = resp.json()
-    s3.put_object(Bucket=bucket, Key=f"{args.prefix}/symbology_{args.job_id}.json", Body=json.dumps(raw))
+    store.put(f"{args.prefix}/symbology_{args.job_id}.json", json.dumps(raw))
     print(f"Uploaded symbology_{args.job_id}.json")
 else:
     print("No symbology file found (something has probably gone wrong)")
 
 
+# One listing up front instead of a HEAD per file. Files already there at
+# the right size are skipped; anything else is (re)uploaded.
+existing = store.list_sizes(f"{args.prefix}/")
+done = {name for name in data_files if existing.get(f"{args.prefix}/{name}") == files_by_name[name]["size"]}
+print(f"Already in store: {len(done)} of {len(data_files)}")
+
+sessions = threading.local()
+
+
+class IntegrityError(Exception):
+    pass
+
+
+# Download, integrity and store (S3 or local disk) errors are retried; anything
+# still failing after MAX_ATTEMPTS is reported and left for a re-run.
+RETRYABLE = (requests.RequestException, IntegrityError, BotoCoreError, ClientError, OSError)
+
+
+def http():
+    if not hasattr(sessions, "session"):
+        sessions.session = requests.Session()
+        sessions.session.auth = auth
+    return sessions.session
+
+
+# Streams a file from Databento straight into the store (a multipart upload
+# on S3), hashing as it goes. If the size or checksum doesn't match what
+# Databento lists for the file, the upload is aborted and nothing appears at
+# the key.
+def stream_file(info, key):
+    algo, _, expected = info.get("hash", "").partition(":")
+    digest = hashlib.new(algo) if expected else None
+    size = 0
+    with http().get(info["urls"]["https"], stream=True, timeout=60) as resp:
+        resp.raise_for_status()
+        with store.open_writer(key) as out:
+            for chunk in resp.iter_content(CHUNK_SIZE):
+                out.write(chunk)
+                size += len(chunk)
+                if digest is not None:
+                    digest.update(chunk)
+            if size != info["size"]:
+                raise IntegrityError(f"got {size} bytes, expected {info['size']}")
+            if digest is not None and digest.hexdigest() != expected:
+                raise IntegrityError(f"{algo} mismatch")
+    return size
+
+
 def ingest_file(filename):
-    s3_key = f"{args.prefix}/{filename}"
-    try:
-        s3.head_object(Bucket=bucket, Key=s3_key)
+    if filename in done:
         return f"SKIP: {filename}"
-    except:
-        pass
-    client.batch.download(job_id=args.job_id, filename_to_download=filename, output_dir="/tmp")
-    local_path = f"/tmp/{args.job_id}/{filename}"
-    s3.upload_file(local_path, bucket, s3_key)
-    os.remove(local_path)
-    return f"UPLOADED: {filename}"
+    info = files_by_name[filename]
+    key = f"{args.prefix}/{filename}"
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            started = time.monotonic()
+            size = stream_file(info, key)
+            return f"UPLOADED: {filename} ({size / 1024**2 / (time.monotonic() - started):.1f} MiB/s)"
+        except RETRYABLE as e:
+            if attempt == MAX_ATTEMPTS - 1:
+                return f"FAILED: {filename}: {e}"
+            time.sleep(2 ** (attempt + 1))
+        except Exception as e:
+            # Not worth retrying, but one bad file shouldn't stop the rest.
+            return f"FAILED: {filename}: {e!r}"
 
 
+print(f"Streaming with {args.workers} workers, up to {args.workers * MULTIPART_PART_SIZE / 1024**2:.0f} MiB buffered")
+failed = []
 with ThreadPoolExecutor(max_workers=args.workers) as executor:
     futures = {executor.submit(ingest_file, f): f for f in data_files}
     for future in as_completed(futures):
-        print(future.result())
+        result = future.result()
+        if result.startswith("FAILED"):
+            failed.append(futures[future])
+        print(result)
 
+if failed:
+    print(f"{len(failed)} files failed, re-run to retry them")
+    exit(1)
 print("Done!")
@@ -2,115 +2,167 @@ import os
 
 import modal
 
-image = modal.Image.debian_slim().pip_install("databento", "pandas", "pyarrow", "boto3", "exchange_calendars")
+image = (
+    modal.Image.debian_slim()
+    .pip_install("databento", "numpy", "pandas", "pyarrow", "boto3")
+    .add_local_python_source("config", "sessions", "symbology")
+)
 app = modal.App("bad-apple-forward-fill", image=image)
 
 INTERVAL_15MIN_NS = 15 * 60 * 1_000_000_000
 INTERVAL_1MIN_NS = 60 * 1_000_000_000
-
-
-def _get_s3_client_remote():
-    import boto3
-    return boto3.client("s3",
-        aws_access_key_id=os.environ["AWS_ACCESS_KEY_ID"],
-        aws_secret_access_key=os.environ["AWS_SECRET_ACCESS_KEY"])
-
-
-def build_symbology_for_date(all_symbology_files, date_str):
-    mapping = {}
-    for sym_data in all_symbology_files:
-        file_start = sym_data["start_date"][:10]
-        file_end = sym_data["end_date"][:10]
-        if not (file_start <= date_str < file_end):
-            continue
-        for symbol, entries in sym_data.get("result", {}).items():
-            for entry in entries:
-                d0, d1 = entry["d0"], entry["d1"]
-                if d0 <= date_str < d1:
-                    inst_id = str(entry["s"])
-                    if inst_id in mapping and mapping[inst_id] != symbol:
-                        raise ValueError(
-                            f"Symbology conflict: instrument {inst_id} on {date_str} "
-                            f"maps to both {mapping[inst_id]} and {symbol}"
-                        )
-                    mapping[inst_id] = symbol
-    return mapping
-
-
-@app.function(secrets=[modal.Secret.from_name("bad-apple")], timeout=3600, memory=65536)
-def process_day(date_str, all_symbology_files):
-    import io
+BBO_BATCH_SIZE = 1_000_000
+FIXED_PRICE_SCALE = 1e9
+UNDEF_PRICE = 2**63 - 1
+# Reserved per day on Modal, and the per-worker cap when run locally.
+MEMORY_MB = 8192
+
+
+# Tracks the last quote at or before each grid boundary for every symbol while
+# the day is fed in batches. Each quote is bucketed to the first boundary at or
+# after it, only the latest quote per (symbol, bucket) cell is kept, and the
+# cells are forward-filled once at the end. Memory is one dense
+# (n_codes, len(grid_ns)) state no matter how many quotes the day has.
+class LastQuotes:
+    def __init__(self, n_codes, grid_ns):
+        import numpy as np
+
+        self.grid_ns = grid_ns
+        shape = (n_codes, len(grid_ns))
+        self.quote_ts = np.full(shape, -1, dtype=np.int64)
+        self.mid = np.full(shape, np.nan)
+        self.spread_bps = np.full(shape, np.nan)
+
+    def update(self, codes, ts, mid, spread_bps):
+        import numpy as np
+
+        n_periods = len(self.grid_ns)
+        bucket = np.searchsorted(self.grid_ns, ts, side="left")
+        keep = bucket < n_periods
+        cell = codes[keep].astype(np.int64) * n_periods + bucket[keep]
+        ts, mid, spread_bps = ts[keep], mid[keep], spread_bps[keep]
+
+        # lexsort is stable, so among equal timestamps the later record wins.
+        order = np.lexsort((ts, cell))
+        cell_sorted = cell[order]
+        last = order[np.r_[cell_sorted[1:] != cell_sorted[:-1], True]] if len(order) else order
+        cell = cell[last]
+        newer = ts[last] >= self.quote_ts.ravel()[cell]
+        cell, last = cell[newer], last[newer]
+        self.quote_ts.ravel()[cell] = ts[last]
+        self.mid.ravel()[cell] = mid[last]
+        self.spread_bps.ravel()[cell] = spread_bps[last]
+
+    def result(self):
+        import numpy as np
+
+        has_quote = self.quote_ts >= 0
+        src = np.where(has_quote, np.arange(len(self.grid_ns)), 0)
+        np.maximum.accumulate(src, axis=1, out=src)
+        rows = np.arange(len(src))[:, None]
+        filled = has_quote[rows, src]
+        quote_ts = np.where(filled, self.quote_ts[rows, src], -1)
+        mid = np.where(filled, self.mid[rows, src], np.nan)
+        spread_bps = np.where(filled, self.spread_bps[rows, src], np.nan)
+        return quote_ts, mid, spread_bps
+
+
+# Decodes a BBO-1s file a batch of records at a time and yields only what the
+# resampler needs. Prices stay fixed-point until after the market-hours,
+# positive-quote and symbology filters, so the full day never exists as a
+# DataFrame.
+def read_bbo_batches(path, market_close_ns, inst_ids, inst_codes, batch_size=BBO_BATCH_SIZE):
     import databento as db
+    import numpy as np
+
+    for batch in db.DBNStore.from_file(path).to_ndarray(count=batch_size):
+        ts = batch["ts_recv"].astype(np.int64)
+        bid, ask = batch["bid_px_00"], batch["ask_px_00"]
+        keep = ((ts < market_close_ns) & (bid > 0) & (ask > 0)
+                & (bid != UNDEF_PRICE) & (ask != UNDEF_PRICE))
+        inst = batch["instrument_id"][keep].astype(np.int64)
+        pos = np.minimum(np.searchsorted(inst_ids, inst), len(inst_ids) - 1)
+        mapped = inst_ids[pos] == inst
+        ts = ts[keep][mapped]
+        bid = bid[keep][mapped] / FIXED_PRICE_SCALE
+        ask = ask[keep][mapped] / FIXED_PRICE_SCALE
+        mid = (bid + ask) / 2
+        yield inst_codes[pos[mapped]], ts, mid, (ask - bid) / mid * 10000
+
+
+def quotes_to_frame(symbols, grid_ns, mid, spread_bps):
+    import numpy as np
     import pandas as pd
-    import exchange_calendars as xcals
-    from botocore.exceptions import ClientError
 
-    s3 = _get_s3_client_remote()
-    bucket = os.environ["S3_BUCKET_NAME"]
+    sym_idx, period_idx = np.nonzero(~np.isnan(mid))
+    return pd.DataFrame({
+        "symbol": symbols[sym_idx],
+        "period": pd.to_datetime(grid_ns[period_idx], unit="ns", utc=True),
+        "mid": mid[sym_idx, period_idx],
+        "spread_bps": spread_bps[sym_idx, period_idx],
+    })
+
+
+@app.function(secrets=[modal.Secret.from_name("bad-apple")], timeout=3600, memory=MEMORY_MB)
+def process_day(date_str, symbology_index, sessions):
+    import io
+    import numpy as np
+    from config import get_store
+    from sessions import Sessions
+    from symbology import SymbologyIndex
 
-    def exists(key):
-        try:
-            s3.head_object(Bucket=bucket, Key=key)
-            return True
-        except ClientError as e:
-            if e.response["Error"]["Code"] == "404":
-                return False
-            raise
+    store = get_store()
 
-    need_15min = not exists(f"bbo_15min/{date_str}.parquet")
-    need_1min = not exists(f"bbo_1min/{date_str}.parquet")
+    need_15min = not store.exists(f"bbo_15min/{date_str}.parquet")
+    need_1min = not store.exists(f"bbo_1min/{date_str}.parquet")
 
     if not need_15min and not need_1min:
         return f"SKIP {date_str}: already processed"
 
-    schedule = xcals.get_calendar("XNAS").schedule.loc[date_str:date_str]
-    if schedule.empty:
+    session = Sessions.from_bytes(sessions).on([date_str])
+    if len(session) == 0:
         return f"SKIP {date_str}: market closed"
 
-    symbology = build_symbology_for_date(all_symbology_files, date_str)
-    if not symbology:
+    symbology = SymbologyIndex.from_bytes(symbology_index)
+    inst_ids, codes = symbology.instruments_on(date_str)
+    if len(inst_ids) == 0:
         return f"SKIP {date_str}: no symbology"
 
-    market_open_ns = int(schedule.iloc[0]["open"].value)
-    market_close_ns = int(schedule.iloc[0]["close"].value)
+    market_close_ns = int(session.close_ns[0])
     date_compact = date_str.replace("-", "")
 
     bbo_local = f"/tmp/bbo_{date_str}.dbn.zst"
-    s3.download_file(bucket, f"bbo/xnas-itch-{date_compact}.bbo-1s.dbn.zst", bbo_local)
-    bbo_df = db.DBNStore.from_file(bbo_local).to_df().reset_index()
-    bbo_df['ts_recv'] = bbo_df['ts_recv'].astype('int64')
-    bbo_df = bbo_df[(bbo_df['ts_recv'] < market_close_ns) & (bbo_df['bid_px_00'] > 0) & (bbo_df['ask_px_00'] > 0)].copy()
-    bbo_df['symbol'] = bbo_df['instrument_id'].astype(str).map(symbology)
-    bbo_df = bbo_df.dropna(subset=['symbol'])
-    bbo_df['mid'] = (bbo_df['bid_px_00'] + bbo_df['ask_px_00']) / 2
-    bbo_df['spread_bps'] = (bbo_df['ask_px_00'] - bbo_df['bid_px_00']) / bbo_df['mid'] * 10000
-    bbo_df['ts'] = pd.to_datetime(bbo_df['ts_recv'], unit='ns', utc=True)
-    bbo_df = bbo_df.sort_values('ts')
+    store.download(f"bbo/xnas-itch-{date_compact}.bbo-1s.dbn.zst", bbo_local)
+
+    sym_codes, inst_codes = np.unique(codes, return_inverse=True)
+    symbols = symbology.symbols[sym_codes]
+
+    # Both grids start at the open, so the 15-min boundaries are every 15th
+    # 1-min boundary and a single pass on the 1-min grid covers both.
+    grid_1min = session.minute_grid().periods
+    quotes = LastQuotes(len(symbols), grid_1min)
+    for batch in read_bbo_batches(bbo_local, market_close_ns, inst_ids, inst_codes):
+        quotes.update(*batch)
     os.remove(bbo_local)
+    _, mid, spread_bps = quotes.result()
+    del quotes
 
     results = []
+    step = INTERVAL_15MIN_NS // INTERVAL_1MIN_NS
 
-    def resample_bbo(interval_ns, output_key):
-        period_starts = pd.to_datetime(list(range(market_open_ns, market_close_ns, interval_ns)), unit='ns', utc=True)
-        period_df = pd.DataFrame({'period': period_starts})
-        bbo_results = []
-        for sym, grp in bbo_df.groupby('symbol'):
-            merged = pd.merge_asof(period_df, grp[['ts', 'mid', 'spread_bps']], left_on='period', right_on='ts', direction='backward').dropna()
-            merged['symbol'] = sym
-            bbo_results.append(merged[['symbol', 'period', 'mid', 'spread_bps']])
-        final = pd.concat(bbo_results, ignore_index=True).sort_values(['symbol', 'period'])
+    def write_bbo(grid_ns, mid, spread_bps, output_key):
+        final = quotes_to_frame(symbols, grid_ns, mid, spread_bps)
         buf = io.BytesIO()
         final.to_parquet(buf, index=False)
-        buf.seek(0)
-        s3.put_object(Bucket=bucket, Key=output_key, Body=buf.getvalue())
+        store.put(output_key, buf.getvalue())
         return len(final)
 
     if need_15min:
-        n = resample_bbo(INTERVAL_15MIN_NS, f"bbo_15min/{date_str}.parquet")
+        n = write_bbo(grid_1min[::step], mid[:, ::step], spread_bps[:, ::step], f"bbo_15min/{date_str}.parquet")
         results.append(f"15min={n}")
 
     if need_1min:
-        n = resample_bbo(INTERVAL_1MIN_NS, f"bbo_1min/{date_str}.parquet")
+        n = write_bbo(grid_1min, mid, spread_bps, f"bbo_1min/{date_str}.parquet")
         results.append(f"1min={n}")
 
     return f"SUCCESS {date_str}: {', '.join(results)}"
@@ -119,15 +171,16 @@ def process_day(date_str, all_symbology_files):
 @app.local_entrypoint()
 def main():
     import json
-    from pathlib import Path
-    from config import get_s3_client, get_s3_bucket
+    from config import get_store
+    from executors import get_executor
+    from sessions import Sessions
+    from symbology import SymbologyIndex
 
-    s3 = get_s3_client()
-    bucket = get_s3_bucket()
+    store = get_store()
 
     dates = set()
-    for obj in s3.list_objects_v2(Bucket=bucket, Prefix="bbo/").get("Contents", []):
-        filename = obj["Key"].split("/")[-1]
+    for key in store.list("bbo/"):
+        filename = key.split("/")[-1]
         if filename.endswith(".dbn.zst") and "symbology" not in filename:
             date_part = filename.split("-")[2].split(".")[0]
             dates.add(f"{date_part[:4]}-{date_part[4:6]}-{date_part[6:8]}")
@@ -136,20 +189,24 @@ def main():
     print(f"Processing {len(dates)} days: {dates[0]} to {dates[-1]}")
 
     all_symbology_files = []
-    for obj in s3.list_objects_v2(Bucket=bucket, Prefix="bbo/symbology_").get("Contents", []):
-        sym_data = json.loads(s3.get_object(Bucket=bucket, Key=obj["Key"])["Body"].read())
+    for key in store.list("bbo/symbology_"):
+        sym_data = json.loads(store.get(key))
         all_symbology_files.append(sym_data)
-        print(f"Loaded {obj['Key']}: {sym_data['start_date'][:10]} to {sym_data['end_date'][:10]}")
+        print(f"Loaded {key}: {sym_data['start_date'][:10]} to {sym_data['end_date'][:10]}")
     print(f"Total symbology files: {len(all_symbology_files)}")
 
-    for res in process_day.map(dates, kwargs={"all_symbology_files": all_symbology_files}):
+    symbology_index = SymbologyIndex.from_files(all_symbology_files).to_bytes()
+    print(f"Symbology index: {len(symbology_index) / 1e6:.1f} MB")
+    sessions = Sessions.load(dates[0], dates[-1]).on(dates).to_bytes()
+
+    executor = get_executor(MEMORY_MB)
+    for res in executor.map(process_day, dates, symbology_index=symbology_index, sessions=sessions):
         print(res)
 
-    print("Downloading bbo_15min data...")
-    bbo_dir = Path("data/bbo_15min")
-    bbo_dir.mkdir(parents=True, exist_ok=True)
-    for obj in s3.list_objects_v2(Bucket=bucket, Prefix="bbo_15min/").get("Contents", []):
-        filename = obj["Key"].split("/")[-1]
-        if filename.endswith(".parquet"):
-            s3.download_file(bucket, obj["Key"], str(bbo_dir / filename))
-    print(f"Downloaded to {bbo_dir}")
+
+# `python 5_forward_fill.py` runs every day in local processes (see
+# executors.py) instead of on Modal.
+if __name__ == "__main__":
+    os.environ.setdefault("EXECUTOR", "local")
+    main()
+
@@ -0,0 +1,21 @@
+import argparse
+
+from config import DATA_DIR, STORE_WORKERS, get_store
+from panel import INTERVALS, build_panels, upload_panel
+from partitions import MAX_INFLIGHT_BYTES
+
+PANEL_DIR = DATA_DIR / "panels"
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--workers", type=int, default=STORE_WORKERS)
+parser.add_argument("--max-inflight-mb", type=int, default=MAX_INFLIGHT_BYTES // 1024**2)
+args = parser.parse_args()
+
+store = get_store()
+
+print("Building BBO panels...")
+build_panels(store, PANEL_DIR, workers=args.workers, max_bytes=args.max_inflight_mb * 1024**2)
+
+for interval in INTERVALS:
+    upload_panel(store, interval, PANEL_DIR)
+    print(f"Uploaded panels/{interval}/")
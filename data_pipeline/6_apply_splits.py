@@ -1,89 +1,111 @@
 import json
+from concurrent.futures import ThreadPoolExecutor
 
 import databento as db
-import exchange_calendars as xcals
 import numpy as np
 import pandas as pd
 
-from config import get_s3_client, get_s3_bucket
-
-s3 = get_s3_client()
-bucket = get_s3_bucket()
-xnas = xcals.get_calendar("XNAS")
-
-ohlcv_dfs = []
-symbology = {}
-for obj in s3.list_objects_v2(Bucket=bucket, Prefix="ohlcv/").get("Contents", []):
-    key = obj["Key"]
-    if key.endswith(".ohlcv-1d.dbn.zst"):
-        body = s3.get_object(Bucket=bucket, Key=key)["Body"].read()
-        with open("/tmp/ohlcv.dbn.zst", "wb") as f:
-            f.write(body)
-        df = db.DBNStore.from_file("/tmp/ohlcv.dbn.zst").to_df().reset_index()
-        ohlcv_dfs.append(df)
-    elif "symbology_" in key and key.endswith(".json"):
-        sym_data = json.loads(s3.get_object(Bucket=bucket, Key=key)["Body"].read())
-        for symbol, entries in sym_data.get("result", {}).items():
-            for entry in entries:
-                symbology[str(entry["s"])] = symbol
+from config import STORE_WORKERS, CachedStore, get_store
+from sessions import Sessions
+from symbology import SymbologyIndex
+
+store = get_store()
+
+
+# Fetches and decodes one OHLCV-1d object without touching disk.
+def load_ohlcv(key):
+    return db.DBNStore.from_bytes(store.get(key)).to_df().reset_index()
+
+
+keys = store.list("ohlcv/")
+with ThreadPoolExecutor(max_workers=STORE_WORKERS) as executor:
+    ohlcv_dfs = list(executor.map(load_ohlcv, [k for k in keys if k.endswith(".ohlcv-1d.dbn.zst")]))
+symbology_files = [json.loads(body) for body in
+                   store.get_many([k for k in keys if "symbology_" in k and k.endswith(".json")]).values()]
+symbology = SymbologyIndex.from_files(symbology_files)
 
 if not ohlcv_dfs:
     raise ValueError("No OHLCV-1d data found in S3. OHLCV-1d data is required for split detection.")
 else:
     ohlcv_df = pd.concat(ohlcv_dfs, ignore_index=True)
-    ohlcv_df["symbol"] = ohlcv_df["instrument_id"].astype(str).map(symbology)
-    ohlcv_df = ohlcv_df.dropna(subset=["symbol"])
+    codes = symbology.lookup(ohlcv_df["instrument_id"].to_numpy(), ohlcv_df["ts_event"].values)
+    ohlcv_df = ohlcv_df[codes >= 0].copy()
+    ohlcv_df["symbol"] = symbology.symbols[codes[codes >= 0]]
     ohlcv_df["date"] = pd.to_datetime(ohlcv_df["ts_event"]).dt.strftime("%Y-%m-%d")
-    daily_closes = ohlcv_df.pivot_table(index="date", columns="symbol", values="close", aggfunc="last")
+    daily_closes = ohlcv_df.pivot_table(index="date", columns="symbol", values="close", aggfunc="last").sort_index()
     daily_opens = ohlcv_df.pivot_table(index="date", columns="symbol", values="open", aggfunc="first")
-    dates_sorted = sorted(daily_closes.index.tolist())
+    daily_opens = daily_opens.reindex(index=daily_closes.index, columns=daily_closes.columns)
+    dates_sorted = daily_closes.index.tolist()
     print(f"Loaded {len(dates_sorted)} days of OHLCV data from S3 for {len(daily_closes.columns)} symbols")
 
     ohlcv_counts = ohlcv_df.groupby("symbol")["date"].nunique()
     ohlcv_complete_symbols = sorted(ohlcv_counts[ohlcv_counts == len(dates_sorted)].index.tolist())
     print(f"Symbols with complete OHLCV data: {len(ohlcv_complete_symbols)} / {len(daily_closes.columns)}")
 
-def first_trading_day_on_or_after(date_str):
-    sched = xnas.schedule.loc[date_str:]
-    return str(sched.index[0].date()) if len(sched) > 0 else None
+# Overnight log gaps, log(open_t / close_{t-1}), days x symbols. NaN on the
+# first day and wherever either price is missing or not positive, which never
+# matches a split.
+dates = np.array(dates_sorted)
+session_days = np.array(Sessions.load(dates_sorted[0], dates_sorted[-1]).labels())
+sym_to_col = {s: i for i, s in enumerate(daily_closes.columns)}
+closes = daily_closes.to_numpy(dtype=np.float64)
+opens = daily_opens.to_numpy(dtype=np.float64)
+log_gap = np.full(closes.shape, np.nan)
+with np.errstate(divide="ignore", invalid="ignore"):
+    priced = (closes[:-1] > 0) & (opens[1:] > 0)
+    log_gap[1:] = np.where(priced, np.log(opens[1:] / closes[:-1]), np.nan)
+
+# Use extended window only for large splits (factor > 2 or < 0.5)
+# Small factors are usually accurately dated and risk false matches
+LARGE_SPLIT_WINDOW = 30
+SMALL_SPLIT_WINDOW = 4
+
 
 # This wouldn't be necessary if I could figure out how the hell to find
 # the CORRECT application date for adjustment factors
-def find_split_date(sym, lseg_date_str, factor):
-    start_date = first_trading_day_on_or_after(lseg_date_str)
-    if not start_date or start_date not in dates_sorted:
-        return None
-    start_idx = dates_sorted.index(start_date)
-    # Use extended window only for large splits (factor > 2 or < 0.5)
-    # Small factors are usually accurately dated and risk false matches
-    search_days = 30 if (factor > 2 or factor < 0.5) else 4
-    for offset in range(search_days):
-        candidate_idx = start_idx + offset
-        if candidate_idx >= len(dates_sorted) or candidate_idx < 1:
-            continue
-        prev_date = dates_sorted[candidate_idx - 1]
-        curr_date = dates_sorted[candidate_idx]
-        prev_price = daily_closes.loc[prev_date, sym] if sym in daily_closes.columns else None
-        curr_price = daily_opens.loc[curr_date, sym] if sym in daily_opens.columns else None
-        if prev_price and curr_price and prev_price > 0 and not np.isnan(prev_price) and not np.isnan(curr_price):
-            ratio = curr_price / prev_price
-            if abs(np.log(ratio) - np.log(factor)) < 0.2:
-                return curr_date
-    return None
-
-splits_lseg = json.loads(s3.get_object(Bucket=bucket, Key="config/splits_lseg.json")["Body"].read())
+#
+# For every split at once: the first OHLCV day in a window starting at the
+# first trading day on or after the LSEG date whose overnight gap is within
+# 0.2 log points of the factor, or None.
+def find_split_dates(syms, lseg_dates, factors):
+    factors = np.asarray(factors, dtype=np.float64)
+    cols = np.array([sym_to_col.get(s, -1) for s in syms], dtype=np.int64)
+    session_idx = np.searchsorted(session_days, [d[:10] for d in lseg_dates])
+    start_days = session_days[np.minimum(session_idx, len(session_days) - 1)]
+    start_idx = np.searchsorted(dates, start_days)
+    start_ok = (session_idx < len(session_days)) & (start_idx < len(dates))
+    start_ok &= dates[np.minimum(start_idx, len(dates) - 1)] == start_days
+
+    window = np.where((factors > 2) | (factors < 0.5), LARGE_SPLIT_WINDOW, SMALL_SPLIT_WINDOW)
+    offsets = np.arange(LARGE_SPLIT_WINDOW)
+    idx = start_idx[:, None] + offsets
+    ok = (start_ok & (cols >= 0))[:, None] & (offsets < window[:, None]) & (idx >= 1) & (idx < len(dates))
+    gaps = log_gap[np.minimum(idx, len(dates) - 1), cols[:, None]]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        hit = ok & (np.abs(gaps - np.log(factors)[:, None]) < 0.2)
+    first = hit.argmax(axis=1)
+    found = hit.any(axis=1)
+    return [str(dates[idx[i, first[i]]]) if found[i] else None for i in range(len(factors))]
+
+splits_lseg = json.loads(store.get("config/splits_lseg.json"))
 print(f"Loaded {len(splits_lseg)} symbols with splits from LSEG")
 
 ohlcv_start = dates_sorted[0]
 ohlcv_end = dates_sorted[-1]
 
+in_range = [(sym, j, info) for sym, split_list in splits_lseg.items() for j, info in enumerate(split_list)
+            if ohlcv_start <= info["date"] <= ohlcv_end]
+matched = find_split_dates([sym for sym, _, _ in in_range], [info["date"] for _, _, info in in_range],
+                           [info["factor"] for _, _, info in in_range])
+actual_dates = {(sym, j): d for (sym, j, _), d in zip(in_range, matched)}
+
 splits = {}
 dropped_symbols = []
 
 for sym, split_list in splits_lseg.items():
     sym_splits = {}
     sym_dropped = False
-    for split_info in split_list:
+    for j, split_info in enumerate(split_list):
         date_str = split_info["date"]
         factor = split_info["factor"]
         date_type = split_info["date_type"]
@@ -91,7 +113,7 @@ for sym, split_list in splits_lseg.items():
         if date_str < ohlcv_start or date_str > ohlcv_end:
             continue
 
-        actual_date = find_split_date(sym, date_str, factor)
+        actual_date = actual_dates[(sym, j)]
         if not actual_date:
             print(f"  Dropping {sym}: no price match for {date_str} factor={factor:.2f}")
             sym_dropped = True
@@ -109,12 +131,12 @@ print(f"Processed {sum(len(v) for v in splits.values())} splits across {len(spli
 if dropped_symbols:
     print(f"Dropped {len(dropped_symbols)} symbols due to unverifiable effective_date splits")
 
-s3.put_object(Bucket=bucket, Key="config/splits.json", Body=json.dumps(splits))
+store.put("config/splits.json", json.dumps(splits))
 
 # I am also manually adjusting the dividends here because IDK what goes into
 # LSEG's adjusted dividend data. They might include other factors that I'd
 # rather not include.
-dividends = json.loads(s3.get_object(Bucket=bucket, Key="config/dividends.json")["Body"].read())
+dividends = json.loads(store.get("config/dividends.json"))
 adjusted_dividends = {}
 for pay_date, syms in dividends.items():
     pay_date_divs = {}
@@ -127,9 +149,11 @@ for pay_date, syms in dividends.items():
     if pay_date_divs:
         adjusted_dividends[pay_date] = pay_date_divs
 
-s3.put_object(Bucket=bucket, Key="config/dividends_adjusted.json", Body=json.dumps(adjusted_dividends))
+store.put("config/dividends_adjusted.json", json.dumps(adjusted_dividends))
 print("Wrote adjusted dividends to config/dividends_adjusted.json")
 
 final_ohlcv_complete = [s for s in ohlcv_complete_symbols if s not in dropped_symbols]
-s3.put_object(Bucket=bucket, Key="config/ohlcv_complete_symbols.json", Body=json.dumps(final_ohlcv_complete))
+store.put("config/ohlcv_complete_symbols.json", json.dumps(final_ohlcv_complete))
 print(f"Wrote {len(final_ohlcv_complete)} OHLCV-complete symbols to config/ohlcv_complete_symbols.json")
+if isinstance(store, CachedStore):
+    print(store.summary())
@@ -1,117 +1,101 @@
+import argparse
 import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 
-import exchange_calendars as xcals
 import numpy as np
 import pandas as pd
 from numba import njit, prange
-from scipy.optimize import linear_sum_assignment
+from scipy import sparse
 
-from config import DATA_DIR, NUM_PIXELS, WIDTH, HEIGHT, get_s3_client, get_s3_bucket
+from assignment import objective, solve_dense, solve_sparse
+from config import DATA_DIR, NUM_PIXELS, WIDTH, HEIGHT, CachedStore, get_store
+from corporate_actions import Dividends, Splits
+from frames import Frames
+from panel import fetch_panel
+from rowcache import RowCache, cached_rows, fingerprint
 
 
-BBO_15MIN_DIR = DATA_DIR / "bbo_15min"
+PANEL_DIR = DATA_DIR / "panels"
+ROW_CACHE_DIR = DATA_DIR / "row_cache"
 FORCED_ASSIGNMENTS = {
     "AAPL": 0,   "NVDA": 1,   "TSLA": 2,
     "MSFT": 64,  "AMZN": 65,  "GOOGL": 66,
     "META": 128, "NFLX": 129, "AMD": 130,
 }
 
-s3 = get_s3_client()
-bucket = get_s3_bucket()
-
-splits_raw = json.loads(s3.get_object(Bucket=bucket, Key="config/splits.json")["Body"].read())
-split_cutoffs = {sym: sorted([(pd.Timestamp(d, tz="UTC"), float(f)) for d, f in dates.items()])
-                 for sym, dates in splits_raw.items()}
-
-print("Loading BBO data...")
-bbo_dfs = [pd.read_parquet(f) for f in sorted(BBO_15MIN_DIR.glob("*.parquet"))]
-bbo_df = pd.concat(bbo_dfs, ignore_index=True)
-bbo_df = bbo_df[bbo_df["spread_bps"] >= 0]
-
-xnas = xcals.get_calendar("XNAS")
-valid_periods = set()
-for date in bbo_df["period"].dt.date.unique():
-    sched = xnas.schedule.loc[str(date):str(date)]
-    if sched.empty:
-        continue
-    t = sched.iloc[0]["open"] + pd.Timedelta(minutes=15)
-    end = sched.iloc[0]["close"] - pd.Timedelta(minutes=15)
-    while t <= end:
-        valid_periods.add(t)
-        t += pd.Timedelta(minutes=15)
-
-bbo_df = bbo_df[bbo_df["period"].isin(valid_periods)]
-periods = sorted(bbo_df["period"].unique())
+parser = argparse.ArgumentParser()
+parser.add_argument("--solver", choices=["dense", "sparse"], default="dense")
+parser.add_argument("--top-k", type=int, default=32)
+parser.add_argument("--check-dense", action="store_true")
+parser.add_argument("--no-row-cache", action="store_true")
+parser.add_argument("--sweep", help="parquet of candidate narratives: a timestamp column plus one s_k column per candidate")
+parser.add_argument("--sweep-batch", type=int, default=16)
+parser.add_argument("--sweep-workers", type=int, default=os.cpu_count())
+args = parser.parse_args()
+
+store = get_store()
+
+splits_raw = json.loads(store.get("config/splits.json"))
+
+print("Loading BBO panel...")
+panel = fetch_panel(store, "15min", PANEL_DIR)
+period_index = panel.period_index()
+periods = list(period_index)
 print(f"Total periods: {len(periods)}")
 
 lseg_covered = pd.read_csv(DATA_DIR / "lseg_covered_symbols.csv")
 lseg_symbols = set(lseg_covered["symbol"])
 print(f"LSEG-covered symbols: {len(lseg_symbols)}")
 
-ohlcv_complete_raw = json.loads(s3.get_object(Bucket=bucket, Key="config/ohlcv_complete_symbols.json")["Body"].read())
+ohlcv_complete_raw = json.loads(store.get("config/ohlcv_complete_symbols.json"))
 ohlcv_complete_symbols = set(ohlcv_complete_raw)
 print(f"OHLCV-complete symbols: {len(ohlcv_complete_symbols)}")
 
-period_counts = bbo_df.groupby("symbol")["period"].nunique()
-full_symbols = sorted(s for s in period_counts[period_counts == len(periods)].index
-                      if s in lseg_symbols and s in ohlcv_complete_symbols)
-bbo_df = bbo_df[bbo_df["symbol"].isin(full_symbols)]
-
-spreads_df = bbo_df.pivot(index="period", columns="symbol", values="spread_bps").sort_index().reindex(periods)
-mid_df = bbo_df.pivot(index="period", columns="symbol", values="mid").sort_index().reindex(periods)
+full_symbols = [s for s in panel.symbols if s in lseg_symbols and s in ohlcv_complete_symbols]
+cols = panel.columns(full_symbols)
+spreads_df = pd.DataFrame(panel.spread_bps[:, cols], index=period_index, columns=full_symbols)
+mid_arr = Splits.from_json(splits_raw, full_symbols).apply(panel.mid[:, cols], panel.periods)
+mid_df = pd.DataFrame(mid_arr, index=period_index, columns=full_symbols)
 symbols = list(spreads_df.columns)
 symbol_to_col = {s: i for i, s in enumerate(symbols)}
 N = len(symbols)
 print(f"Universe: {N} symbols")
 
-for sym, cutoffs in split_cutoffs.items():
-    if sym not in mid_df.columns:
-        continue
-    for cutoff_ts, factor in cutoffs:
-        mid_df.loc[mid_df.index < cutoff_ts, sym] *= factor
-
 price_matrix = mid_df.ffill().to_numpy(dtype=np.float32)
 print("Price matrix built from BBO mid prices.")
 
-dividends_raw = json.loads(s3.get_object(Bucket=bucket, Key="config/dividends_adjusted.json")["Body"].read())
+dividends_raw = json.loads(store.get("config/dividends_adjusted.json"))
+if isinstance(store, CachedStore):
+    print(store.summary())
 div_matrix = np.zeros((len(periods), N), dtype=np.float32)
-period_dates = [p.date() for p in periods]
-date_to_first_idx = {}
-for i, d in enumerate(period_dates):
-    if d not in date_to_first_idx:
-        date_to_first_idx[d] = i
-
-for pay_date, syms in dividends_raw.items():
-    for sym, info in syms.items():
-        j = symbol_to_col.get(sym)
-        if j is None:
-            continue
-        ex_date = pd.Timestamp(info["ex_date"], tz="UTC").date()
-        idx = date_to_first_idx.get(ex_date)
-        if idx is not None:
-            div_matrix[idx, j] = float(info["amount"])
+div_rows, div_cols, div_amounts = Dividends.from_json(dividends_raw, symbols).at_first_period(panel.periods)
+div_matrix[div_rows, div_cols] = div_amounts
 
 returns = np.zeros_like(price_matrix, dtype=np.float32)
 with np.errstate(divide="ignore", invalid="ignore"):
     returns[1:] = (price_matrix[1:] + div_matrix[1:]) / price_matrix[:-1] - 1.0
 returns = np.nan_to_num(returns, nan=0.0, posinf=0.0, neginf=0.0)
 
-bad_apple = pd.read_parquet(DATA_DIR / "bad_apple_frames.parquet")
-bad_apple["timestamp"] = pd.to_datetime(bad_apple["timestamp"], utc=True)
+bad_apple = Frames.load()
 
 narrative_file = DATA_DIR / "bad_apple_narrative.parquet"
 narrative_df = pd.read_parquet(narrative_file) if narrative_file.exists() else None
 if narrative_df is not None:
     narrative_df["timestamp"] = pd.to_datetime(narrative_df["timestamp"], utc=True)
 
-common_periods = sorted(set(bad_apple["timestamp"]) & set(periods))
+common_ns = np.intersect1d(bad_apple.timestamps, panel.periods)
+common_periods = list(pd.to_datetime(common_ns, unit="ns", utc=True))
 print(f"Common simulation periods: {len(common_periods)}")
 
 period_to_idx = {p: i for i, p in enumerate(periods)}
 idx_list = [period_to_idx[p] for p in common_periods]
 returns = returns[idx_list]
 spreads = spreads_df.loc[common_periods].values.astype(np.float32)
-bad_apple = bad_apple[bad_apple["timestamp"].isin(common_periods)].sort_values("timestamp").reset_index(drop=True)
+bad_apple = bad_apple.at(common_ns)
 
 if narrative_df is not None:
     narrative_df = narrative_df[narrative_df["timestamp"].isin(common_periods)].sort_values("timestamp").reset_index(drop=True)
@@ -119,15 +103,17 @@ if narrative_df is not None:
 else:
     s_k = np.ones((len(common_periods), 1), dtype=np.float32)
 
-pixel_cols = [f"p{i}" for i in range(NUM_PIXELS)]
-pixel_vals = bad_apple[pixel_cols].to_numpy(dtype=np.float32)
+weights, _ = bad_apple.weights()
 
-active_mask = pixel_vals > 0
-active_counts = active_mask.sum(axis=1, keepdims=True).astype(np.float32)
-active_counts[active_counts == 0] = 1.0
-weights = pixel_vals / active_counts
+# Edge and background pixels share the same on/off history, so many columns of
+# `weights` are identical and so are their gross and cost columns. Compute them
+# once per distinct trajectory and expand back to pixels afterwards.
+unique_weights, pixel_group = np.unique(weights.T, axis=0, return_inverse=True)
+unique_weights = np.ascontiguousarray(unique_weights.T)
+pixel_group = pixel_group.ravel()
+print(f"Distinct pixel trajectories: {unique_weights.shape[1]} of {weights.shape[1]}")
 
-w_prev, w_curr = weights[:-1], weights[1:]
+w_prev, w_curr = unique_weights[:-1], unique_weights[1:]
 r_curr = returns[1:]
 k_curr = (spreads[1:] / 10000.0 * 0.5).astype(np.float32)
 s_curr = s_k[1:]
@@ -138,39 +124,178 @@ s_curr = s_k[1:]
 # the computation into pieces. We can compute the gross returns using vectorized
 # operations, but we have to iterate through time to compute the tcosts. I've
 # wrapped the iteration in numba so that it's not too painfully slow.
-print(f"Computing returns matrix...")
-sg_prev = (s_curr * w_prev).astype(np.float32)
-gross_matrix = (r_curr.T @ sg_prev).astype(np.float32)
-
-
-print("Computing cost matrix...")
-r_plus_1 = (1.0 + r_curr).astype(np.float32)
+#
+# Bad Apple is mostly black or white, so for a given pixel both w_prev and
+# w_curr are zero for long stretches. Those steps add exactly 0.0 to both the
+# gross return and the tcost, so each pixel only visits the steps where either
+# weight is nonzero (stored CSR-style below). Skipping them doesn't change the
+# summation order of the remaining terms, so the tcosts are bit-identical to
+# looping over every step.
+active_steps = ((w_prev != 0) | (w_curr != 0)).T
+step_ptr = np.concatenate([[0], np.cumsum(active_steps.sum(axis=1))]).astype(np.int64)
+step_idx = np.nonzero(active_steps)[1].astype(np.int64)
+w_prev_nz = w_prev.T[active_steps]
+w_curr_nz = w_curr.T[active_steps]
+print(f"Active pixel-steps: {len(step_idx)} of {active_steps.size} ({len(step_idx) / max(active_steps.size, 1):.1%})")
+
+r_plus_1 = np.ascontiguousarray((1.0 + r_curr).T, dtype=np.float32)
+k_curr = np.ascontiguousarray(k_curr.T)
 
 @njit(parallel=True)
-def compute_cost_matrix(w_prev, w_curr, r_plus_1, k_curr):
-    T, NUM_PIXELS = w_prev.shape
-    N = r_plus_1.shape[1]
+def compute_cost_matrix(step_ptr, step_idx, w_prev_nz, w_curr_nz, r_plus_1, k_curr):
+    NUM_PIXELS = len(step_ptr) - 1
+    N = r_plus_1.shape[0]
     cost = np.zeros((N, NUM_PIXELS), dtype=np.float32)
     for i in prange(NUM_PIXELS):
+        start, end = step_ptr[i], step_ptr[i + 1]
         for j in range(N):
             c = 0.0
-            for k in range(T):
-                drifted = w_prev[k, i] * r_plus_1[k, j]
-                c += abs(w_curr[k, i] - drifted) * k_curr[k, j]
+            for n in range(start, end):
+                k = step_idx[n]
+                drifted = w_prev_nz[n] * r_plus_1[j, k]
+                c += abs(w_curr_nz[n] - drifted) * k_curr[j, k]
             cost[j, i] = c
     return cost
 
-cost_matrix = compute_cost_matrix(w_prev, w_curr, r_plus_1, k_curr)
+# Rows are cached per symbol, keyed on exactly the inputs each one depends on.
+# A symbol's gross row depends on its returns, the weights and the narrative;
+# its cost row on its returns and spreads and the weights but not on the
+# narrative, so re-running with a new narrative reuses every cost row. Changes
+# to the universe only recompute the symbols that are new.
+row_cache = None if args.no_row_cache else RowCache(ROW_CACHE_DIR)
+weights_key = fingerprint(unique_weights)
+narrative_key = fingerprint(s_curr)
+r_rows = np.ascontiguousarray(r_curr.T)
+gross_keys = [fingerprint("gross", r_rows[j], weights_key, narrative_key) for j in range(N)]
+cost_keys = [fingerprint("cost", r_plus_1[j], k_curr[j], weights_key) for j in range(N)]
+
+# A sweep computes its own gross matrices per candidate, so the main
+# narrative's isn't needed.
+if not args.sweep:
+    print("Computing returns matrix...")
+    sg_prev = sparse.csr_matrix((s_curr[step_idx, 0] * w_prev_nz, step_idx, step_ptr), shape=active_steps.shape)
+    gross_matrix, gross_hits = cached_rows(
+        row_cache, gross_keys,
+        lambda rows: np.ascontiguousarray((sg_prev @ r_curr[:, rows]).T, dtype=np.float32),
+    )
+    print(f"Gross rows: {gross_hits} cached, {N - gross_hits} computed")
 
-utility_matrix = gross_matrix - cost_matrix
+print("Computing cost matrix...")
+cost_matrix, cost_hits = cached_rows(
+    row_cache, cost_keys,
+    lambda rows: compute_cost_matrix(step_ptr, step_idx, w_prev_nz, w_curr_nz,
+                                     np.ascontiguousarray(r_plus_1[rows]), np.ascontiguousarray(k_curr[rows])),
+)
+print(f"Cost rows: {cost_hits} cached, {N - cost_hits} computed")
 
 forced_sym_set = {s for s in FORCED_ASSIGNMENTS if s in symbol_to_col}
 forced_pix_set = {FORCED_ASSIGNMENTS[s] for s in forced_sym_set}
 opt_sym_idx = [i for i, s in enumerate(symbols) if s not in forced_sym_set]
 opt_pix_idx = [i for i in range(NUM_PIXELS) if i not in forced_pix_set]
 
-print(f"Solving assignment ({len(opt_sym_idx)} symbols x {len(opt_pix_idx)} pixels)...")
-row_ind, col_ind = linear_sum_assignment(-utility_matrix[np.ix_(opt_sym_idx, opt_pix_idx)])
+# Sweep mode: the cost matrix doesn't depend on the narrative, so each candidate
+# s_k only needs its own gross matrix. A batch of those is one sparse matmul:
+# each candidate's (s_k * w_prev) rows share the CSR pattern of the active
+# steps above, so they're stacked into one (batch * pixels, steps) matrix and
+# multiplied by the returns without ever building the dense product. The
+# solves run in a forked process pool (forked because this script has no
+# __main__ guard, and so the workers see the batch without pickling it). Each
+# worker walks a contiguous run of candidates and warm-starts every solve from
+# the previous one's prices and assignment, so neighbouring narratives in the
+# file should be similar.
+def sweep_gross_batch(s_batch):
+    n, nnz, n_groups = len(s_batch), len(step_idx), len(step_ptr) - 1
+    data = (s_batch[:, step_idx] * w_prev_nz).ravel()
+    indptr = np.concatenate([[0], (step_ptr[1:] + nnz * np.arange(n)[:, None]).ravel()])
+    sg = sparse.csr_matrix((data, np.tile(step_idx, n), indptr), shape=(n * n_groups, active_steps.shape[1]))
+    return (sg @ r_curr).reshape(n, n_groups, N).transpose(0, 2, 1)
+
+
+def solve_sweep_chunk(batch_pos, cands, warm):
+    opt_groups = pixel_group[opt_pix_idx]
+    out = []
+    for pos, cand in zip(batch_pos, cands):
+        t0 = time.perf_counter()
+        utility = (sweep_gross[pos] - cost_matrix)[np.ix_(opt_sym_idx, opt_groups)]
+        solved = solve_sparse(utility, args.top_k, groups=opt_groups, warm=warm)
+        if solved is None:
+            row_ind, col_ind = solve_dense(utility)
+            warm = None
+        else:
+            row_ind, col_ind, prices, _ = solved
+            warm = (prices, row_ind)
+        pixel_symbol = np.full(NUM_PIXELS, -1, dtype=np.int32)
+        pixel_symbol[np.asarray(opt_pix_idx)[col_ind]] = np.asarray(opt_sym_idx)[row_ind]
+        for sym in forced_sym_set:
+            pixel_symbol[FORCED_ASSIGNMENTS[sym]] = symbol_to_col[sym]
+        out.append({
+            "candidate": cand,
+            "objective": objective(utility, row_ind, col_ind),
+            "certified": solved is not None,
+            "solve_seconds": time.perf_counter() - t0,
+            "pixel_symbol": pixel_symbol,
+        })
+    return out, warm
+
+
+if args.sweep:
+    sweep_df = pd.read_parquet(args.sweep)
+    sweep_df["timestamp"] = pd.to_datetime(sweep_df["timestamp"], utc=True)
+    sweep_df = sweep_df.set_index("timestamp").reindex(common_periods)
+    if sweep_df.isna().any().any():
+        sys.exit(f"{args.sweep} doesn't cover every simulation period")
+    cand_names = list(sweep_df.columns)
+    sweep_s = np.ascontiguousarray(sweep_df.to_numpy(dtype=np.float32).T[:, 1:])
+    print(f"Sweeping {len(cand_names)} narratives in batches of {args.sweep_batch}...")
+
+    ctx = multiprocessing.get_context("fork")
+    warms = [None] * args.sweep_workers
+    rows = []
+    t_sweep = time.perf_counter()
+    for start in range(0, len(cand_names), args.sweep_batch):
+        stop = min(start + args.sweep_batch, len(cand_names))
+        sweep_gross = sweep_gross_batch(sweep_s[start:stop])
+        chunks = [c for c in np.array_split(np.arange(stop - start), args.sweep_workers) if len(c)]
+        with ProcessPoolExecutor(len(chunks), mp_context=ctx) as executor:
+            futures = [executor.submit(solve_sweep_chunk, chunk, cand_names[start + chunk[0]:start + chunk[-1] + 1], warms[k])
+                       for k, chunk in enumerate(chunks)]
+            for k, future in enumerate(futures):
+                out, warms[k] = future.result()
+                rows.extend(out)
+        print(f"  {stop}/{len(cand_names)} narratives, {time.perf_counter() - t_sweep:.1f}s")
+
+    sweep_out = DATA_DIR / "narrative_sweep.parquet"
+    pd.DataFrame(rows).to_parquet(sweep_out, index=False)
+    (DATA_DIR / "narrative_sweep_symbols.json").write_text(json.dumps(symbols))
+    print(f"Saved sweep results to {sweep_out}")
+    sys.exit(0)
+
+gross_matrix = gross_matrix[:, pixel_group]
+cost_matrix = cost_matrix[:, pixel_group]
+
+utility_matrix = gross_matrix - cost_matrix
+
+print(f"Solving assignment ({len(opt_sym_idx)} symbols x {len(opt_pix_idx)} pixels, {args.solver})...")
+opt_utility = utility_matrix[np.ix_(opt_sym_idx, opt_pix_idx)]
+t0 = time.perf_counter()
+solved = None
+if args.solver == "sparse":
+    solved = solve_sparse(opt_utility, args.top_k, groups=pixel_group[opt_pix_idx])
+    if solved is None:
+        print("Sparse solve couldn't certify optimality, falling back to dense")
+if solved is not None:
+    row_ind, col_ind, _, gap = solved
+    print(f"Certificate gap: {gap:.3e}")
+else:
+    row_ind, col_ind = solve_dense(opt_utility)
+utility_total = objective(opt_utility, row_ind, col_ind)
+print(f"Solved in {time.perf_counter() - t0:.2f}s, objective {utility_total:.8f}")
+
+if args.check_dense and solved is not None:
+    t0 = time.perf_counter()
+    dense_total = objective(opt_utility, *solve_dense(opt_utility))
+    print(f"Dense solved in {time.perf_counter() - t0:.2f}s, objective gap {dense_total - utility_total:.3e}")
+
 assigned_map = {opt_sym_idx[r]: opt_pix_idx[c] for r, c in zip(row_ind, col_ind)}
 for sym, pix in FORCED_ASSIGNMENTS.items():
     if sym in symbol_to_col:
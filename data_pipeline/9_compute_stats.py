@@ -2,17 +2,17 @@ import json
 import pandas as pd
 import numpy as np
 import yfinance as yf
-import exchange_calendars as xcals
 from pathlib import Path
 
+from sessions import Sessions
+
 DATA_DIR = Path(__file__).parent.parent / "data"
 
 nav = pd.read_parquet(DATA_DIR / "backtest_nav.parquet")
 nav = nav.set_index("period").sort_index()
 
-cal = xcals.get_calendar("XNAS")
-schedule = cal.schedule.loc["2024-12-10":"2025-12-31"]
-trading_minutes_per_year = (schedule["close"] - schedule["open"]).dt.total_seconds().sum() / 60
+sessions = Sessions.load("2024-12-10", "2025-12-31").between("2024-12-10", "2025-12-31")
+trading_minutes_per_year = (sessions.close_ns - sessions.open_ns).sum() / 60e9
 
 initial_nav = nav["nav"].iloc[0]
 final_nav = nav["nav"].iloc[-1]
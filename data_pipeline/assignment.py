@@ -0,0 +1,224 @@
+import numpy as np
+from numba import njit
+from scipy.optimize import linear_sum_assignment
+
+# Solvers for the reduced assignment problem: maximize sum U[j, i] over a
+# matching that gives every pixel (column) a distinct symbol (row). Both return
+# (row_ind, col_ind) like scipy's linear_sum_assignment, sorted by pixel.
+#
+# The sparse solver keeps only the best few symbols for each pixel and runs the
+# same shortest augmenting path algorithm as scipy on that graph. Its symbol
+# duals ("prices") are nonnegative and zero for every unassigned symbol, and
+# for any such prices p,
+#
+#   sum_j p_j + sum_i max_j (U[j, i] - p_j)
+#
+# is an upper bound on every assignment's utility in the full dense problem.
+# When that bound matches what the sparse solution achieves, the sparse
+# solution is optimal for the dense problem too. Otherwise the caller should
+# fall back to the dense solver.
+
+
+def solve_dense(utility):
+    row_ind, col_ind = linear_sum_assignment(-utility)
+    order = np.argsort(col_ind)
+    return row_ind[order], col_ind[order]
+
+
+def objective(utility, row_ind, col_ind):
+    return float(utility[row_ind, col_ind].astype(np.float64).sum())
+
+
+def dual_bound(utility, prices, chunk=256):
+    bound = float(prices.sum())
+    for start in range(0, utility.shape[1], chunk):
+        block = utility[:, start:start + chunk].astype(np.float64)
+        bound += float((block - prices[:, None]).max(axis=0).sum())
+    return bound
+
+
+# Each pixel keeps its top_k symbols, widened to top_k + g - 1 for pixels whose
+# utility column is shared by g pixels, since identical pixels all want the same
+# symbols and would otherwise leave the pruned graph without a full matching.
+def candidates(utility, top_k, groups=None):
+    n_symbols, n_pixels = utility.shape
+    if groups is None:
+        groups = np.arange(n_pixels)
+    group_ids, group_sizes = np.unique(groups, return_counts=True)
+    size_of = dict(zip(group_ids.tolist(), group_sizes.tolist()))
+    top = {}
+    ptr = np.zeros(n_pixels + 1, dtype=np.int64)
+    rows = []
+    for i in range(n_pixels):
+        g = int(groups[i])
+        if g not in top:
+            m = min(n_symbols, top_k + size_of[g] - 1)
+            top[g] = np.sort(np.argpartition(-utility[:, i], m - 1)[:m]) if m < n_symbols else np.arange(n_symbols)
+        rows.append(top[g])
+        ptr[i + 1] = ptr[i] + len(top[g])
+    sym = np.concatenate(rows).astype(np.int64)
+    pix = np.repeat(np.arange(n_pixels), np.diff(ptr))
+    return ptr, sym, utility[sym, pix].astype(np.float64)
+
+
+@njit(cache=True)
+def _heap_push(keys, vals, size, key, val):
+    pos = size
+    keys[pos] = key
+    vals[pos] = val
+    while pos > 0:
+        parent = (pos - 1) // 2
+        if keys[parent] <= keys[pos]:
+            break
+        keys[parent], keys[pos] = keys[pos], keys[parent]
+        vals[parent], vals[pos] = vals[pos], vals[parent]
+        pos = parent
+    return size + 1
+
+
+@njit(cache=True)
+def _heap_pop(keys, vals, size):
+    key, val = keys[0], vals[0]
+    size -= 1
+    keys[0], vals[0] = keys[size], vals[size]
+    pos = 0
+    while True:
+        left = 2 * pos + 1
+        smallest = pos
+        if left < size and keys[left] < keys[smallest]:
+            smallest = left
+        if left + 1 < size and keys[left + 1] < keys[smallest]:
+            smallest = left + 1
+        if smallest == pos:
+            break
+        keys[smallest], keys[pos] = keys[pos], keys[smallest]
+        vals[smallest], vals[pos] = vals[pos], vals[smallest]
+        pos = smallest
+    return key, val, size
+
+
+# Shortest augmenting paths (Dijkstra on reduced costs) for every pixel in
+# `rows`, over the candidate edges only. Costs must be nonnegative and u, v
+# dual feasible on entry. Returns False if some pixel can't be matched.
+@njit(cache=True)
+def _augment(ptr, sym, cost, u, v, row4col, col4row, rows):
+    n_cols = len(v)
+    spc = np.full(n_cols, np.inf)
+    path = np.full(n_cols, -1, dtype=np.int64)
+    scanned = np.zeros(n_cols, dtype=np.bool_)
+    touched = np.empty(n_cols, dtype=np.int64)
+    visited = np.empty(len(ptr) - 1, dtype=np.int64)
+    heap_keys = np.empty(len(sym) + 1)
+    heap_vals = np.empty(len(sym) + 1, dtype=np.int64)
+
+    for cur in rows:
+        n_touched = 0
+        n_visited = 0
+        heap_size = 0
+        min_val = 0.0
+        i = cur
+        sink = -1
+        while sink < 0:
+            visited[n_visited] = i
+            n_visited += 1
+            for n in range(ptr[i], ptr[i + 1]):
+                j = sym[n]
+                if scanned[j]:
+                    continue
+                r = min_val + cost[n] - u[i] - v[j]
+                if r < spc[j]:
+                    if spc[j] == np.inf:
+                        touched[n_touched] = j
+                        n_touched += 1
+                    spc[j] = r
+                    path[j] = i
+                    heap_size = _heap_push(heap_keys, heap_vals, heap_size, r, j)
+            j = -1
+            while heap_size > 0:
+                r, jj, heap_size = _heap_pop(heap_keys, heap_vals, heap_size)
+                if not scanned[jj] and r <= spc[jj]:
+                    j = jj
+                    break
+            if j < 0:
+                return False
+            min_val = spc[j]
+            scanned[j] = True
+            if row4col[j] < 0:
+                sink = j
+            else:
+                i = row4col[j]
+
+        u[cur] += min_val
+        for t in range(1, n_visited):
+            r_i = visited[t]
+            u[r_i] += min_val - spc[col4row[r_i]]
+        for t in range(n_touched):
+            j = touched[t]
+            if scanned[j]:
+                v[j] -= min_val - spc[j]
+
+        j = sink
+        while True:
+            i = path[j]
+            row4col[j] = i
+            prev = col4row[i]
+            col4row[i] = j
+            if i == cur:
+                break
+            j = prev
+
+        for t in range(n_touched):
+            j = touched[t]
+            spc[j] = np.inf
+            path[j] = -1
+            scanned[j] = False
+    return True
+
+
+def _solve_pruned(utility, top_k, groups, prices, row_ind):
+    n_symbols, n_pixels = utility.shape
+    ptr, sym, val = candidates(utility, top_k, groups)
+    cost = float(val.max(initial=0.0)) - val
+    pix = np.repeat(np.arange(n_pixels), np.diff(ptr))
+
+    v = -np.asarray(prices, dtype=np.float64) if prices is not None else np.zeros(n_symbols)
+    col4row = np.array(row_ind, dtype=np.int64) if row_ind is not None else np.full(n_pixels, -1, dtype=np.int64)
+    row4col = np.full(n_symbols, -1, dtype=np.int64)
+    while True:
+        row4col[:] = -1
+        held = col4row >= 0
+        row4col[col4row[held]] = np.flatnonzero(held)
+        v[row4col < 0] = 0.0
+        reduced = cost - v[sym]
+        u = np.full(n_pixels, np.inf)
+        np.minimum.at(u, pix, reduced)
+        keep = np.zeros(n_pixels, dtype=np.bool_)
+        keep[pix[(reduced <= u[pix]) & (sym == col4row[pix])]] = True
+        if keep[held].all():
+            break
+        col4row[~keep] = -1
+
+    ok = _augment(ptr, sym, cost, u, v, row4col, col4row, np.flatnonzero(col4row < 0))
+    return ok, col4row, -v
+
+
+# Returns (row_ind, col_ind, prices, gap), or None when no candidate set up to
+# max_k gives a certified optimum. Each failed round doubles top_k and restarts
+# from the previous round's prices and every match that is still tight under
+# them, which is also how `warm=(prices, row_ind)` from a previous solve of a
+# similar problem is used.
+def solve_sparse(utility, top_k, groups=None, warm=None, max_k=None, rtol=1e-9):
+    n_symbols, n_pixels = utility.shape
+    max_k = min(n_symbols, max_k or 8 * top_k)
+    prices, row_ind = warm if warm is not None else (None, None)
+    k = min(top_k, max_k)
+    while True:
+        ok, row_ind, prices = _solve_pruned(utility, k, groups, prices, row_ind)
+        if ok:
+            primal = objective(utility, row_ind, np.arange(n_pixels))
+            gap = dual_bound(utility, prices) - primal
+            if gap <= rtol * max(1.0, abs(primal)):
+                return row_ind, np.arange(n_pixels), prices, gap
+        if k >= max_k:
+            return None
+        k = min(2 * k, max_k)
@@ -0,0 +1,99 @@
+from pathlib import Path
+
+import pandas as pd
+
+from config import DATA_DIR
+
+# Everything step 3 has ever fetched from LSEG, kept locally as parquet so a
+# re-run only asks about RICs it hasn't seen or hasn't refreshed in a while:
+#
+#   data/corporate_actions/rics.parquet             one row per RIC
+#   data/corporate_actions/dividends.parquet        LSEG dividend rows
+#   data/corporate_actions/capital_changes.parquet  LSEG capital change rows
+#
+# rics.parquet is the watermark table: whether LSEG covers the RIC and when
+# that was checked, and the date its corporate actions are known through
+# (NaT until they've been fetched). Dividend and capital change rows are keyed
+# by the columns in KEYS, and a refetch replaces rows with the same key.
+STORE_DIR = DATA_DIR / "corporate_actions"
+RICS_COLUMNS = {
+    "ric": "object",
+    "covered": "bool",
+    "coverage_checked": "datetime64[ns, UTC]",
+    "actions_through": "datetime64[ns, UTC]",
+}
+KEYS = {
+    "dividends": ["ric", "ex_date", "pay_date", "div_type"],
+    "capital_changes": ["ric", "ex_date", "effective_date", "adjustment_type"],
+}
+
+
+class CorporateActionsStore:
+    def __init__(self, root=STORE_DIR):
+        self.root = Path(root)
+        path = self.root / "rics.parquet"
+        self.rics = (pd.read_parquet(path) if path.exists() else pd.DataFrame(columns=list(RICS_COLUMNS))
+                     ).astype(RICS_COLUMNS).set_index("ric")
+        self.tables = {}
+        for name in KEYS:
+            path = self.root / f"{name}.parquet"
+            self.tables[name] = pd.read_parquet(path) if path.exists() else pd.DataFrame(columns=KEYS[name])
+
+    def save(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.rics.reset_index().to_parquet(self.root / "rics.parquet", index=False)
+        for name, df in self.tables.items():
+            df.to_parquet(self.root / f"{name}.parquet", index=False)
+
+    def _known(self, rics):
+        return self.rics.reindex(pd.Index(rics, name="ric"))
+
+    # RICs whose coverage has never been checked, or that weren't covered as
+    # of before `cutoff` (LSEG may have picked them up since).
+    def needs_coverage(self, rics, cutoff):
+        known = self._known(rics)
+        stale = known["coverage_checked"].isna() | (~known["covered"].astype(bool) & (known["coverage_checked"] < cutoff))
+        return known.index[stale].tolist()
+
+    def set_coverage(self, rics, covered, checked):
+        rows = pd.DataFrame({"covered": [r in covered for r in rics], "coverage_checked": checked},
+                            index=pd.Index(rics, name="ric"))
+        self.rics = self.rics.reindex(self.rics.index.union(rows.index))
+        self.rics.loc[rows.index, ["covered", "coverage_checked"]] = rows
+        self.rics = self.rics.astype({k: v for k, v in RICS_COLUMNS.items() if k != "ric"})
+
+    def covered(self, rics):
+        known = self._known(rics)
+        return known.index[known["covered"].fillna(False).astype(bool)].tolist()
+
+    # Covered RICs among `rics` that need their corporate actions fetched,
+    # grouped by where to start: None for never fetched (the full history),
+    # else the watermark for those fetched before `cutoff`.
+    def needs_actions(self, rics, cutoff):
+        known = self._known(self.covered(rics))
+        through = known["actions_through"]
+        groups = {}
+        if through.isna().any():
+            groups[None] = through.index[through.isna()].tolist()
+        stale = through[through < cutoff]
+        for since, group in stale.groupby(stale):
+            groups[since] = group.index.tolist()
+        return groups
+
+    # Merges freshly fetched rows for a table, replacing rows with the same
+    # key, and keeps rows grouped by RIC in fetch order.
+    def merge(self, name, df):
+        if df is None or df.empty:
+            return
+        old = self.tables[name]
+        merged = pd.concat([old, df], ignore_index=True) if not old.empty else df.reset_index(drop=True)
+        merged = merged.drop_duplicates(KEYS[name], keep="last")
+        self.tables[name] = merged.sort_values("ric", kind="stable").reset_index(drop=True)
+
+    def set_actions_through(self, rics, through):
+        self.rics.loc[list(rics), "actions_through"] = through
+
+    # A table restricted to `rics`.
+    def table(self, name, rics):
+        df = self.tables[name]
+        return df[df["ric"].isin(set(rics))].reset_index(drop=True)
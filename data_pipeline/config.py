@@ -1,4 +1,11 @@
+import hashlib
+import io
+import json
 import os
+import shutil
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 env_file = Path(".env")
@@ -12,6 +19,9 @@ DATA_DIR = Path("data")
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 WIDTH, HEIGHT = 64, 48
 NUM_PIXELS = WIDTH * HEIGHT
+STORE_WORKERS = 16
+MULTIPART_PART_SIZE = 8 * 1024**2
+STORE_CACHE_MAX_BYTES = 20 * 1024**3
 
 
 def get_s3_client():
@@ -25,3 +35,477 @@ def get_s3_client():
 
 def get_s3_bucket():
     return os.environ["S3_BUCKET_NAME"]
+
+
+# Every stage reads and writes pipeline objects through one of these instead
+# of calling boto3 directly. Keys are the same S3-style paths either way
+# ("bbo_15min/2025-01-02.parquet"), so a bucket can be mirrored to a local
+# directory with `aws s3 sync` and the whole pipeline pointed at it with
+# STORAGE_BACKEND=local.
+class ObjectStore(ABC):
+    @abstractmethod
+    def get(self, key):
+        ...
+
+    @abstractmethod
+    def get_range(self, key, start, end):
+        ...
+
+    @abstractmethod
+    def put(self, key, body):
+        ...
+
+    @abstractmethod
+    def exists(self, key):
+        ...
+
+    @abstractmethod
+    def list(self, prefix):
+        ...
+
+    # (etag, size in bytes) for key, or None if it doesn't exist. The etag
+    # changes whenever the object does.
+    @abstractmethod
+    def stat(self, key):
+        ...
+
+    # {key: (etag, size)} for every object under prefix, in one listing.
+    @abstractmethod
+    def list_meta(self, prefix):
+        ...
+
+    def list_sizes(self, prefix):
+        return {key: size for key, (_, size) in self.list_meta(prefix).items()}
+
+    def download(self, key, path):
+        Path(path).write_bytes(self.get(key))
+
+    def upload(self, path, key):
+        self.put(key, Path(path).read_bytes())
+
+    def get_many(self, keys, workers=STORE_WORKERS):
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return dict(zip(keys, executor.map(self.get, keys)))
+
+    def put_many(self, items, workers=STORE_WORKERS):
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(lambda kv: self.put(*kv), items.items()))
+
+    # A writable binary file that ends up at `key` once closed, for outputs
+    # that are produced incrementally. Nothing is visible at `key` until then,
+    # and leaving a `with` block on an exception discards what was written.
+    def open_writer(self, key):
+        return _BufferedWriter(self, key)
+
+
+class _StoreWriter(io.RawIOBase):
+    def __init__(self):
+        self._pos = 0
+        self._failed = False
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def write(self, b):
+        n = len(b)
+        self._write(bytes(b))
+        self._pos += n
+        return n
+
+    def __exit__(self, exc_type, exc, tb):
+        self._failed = exc_type is not None
+        return super().__exit__(exc_type, exc, tb)
+
+    def abort(self):
+        self._failed = True
+        self.close()
+
+    def close(self):
+        if not self.closed:
+            if self._failed:
+                self._abort()
+            else:
+                self._commit()
+        super().close()
+
+
+class _BufferedWriter(_StoreWriter):
+    def __init__(self, store, key):
+        super().__init__()
+        self.store, self.key = store, key
+        self._buf = io.BytesIO()
+
+    def _write(self, b):
+        self._buf.write(b)
+
+    def _commit(self):
+        self.store.put(self.key, self._buf.getvalue())
+
+    def _abort(self):
+        self._buf = None
+
+
+# Sends each MULTIPART_PART_SIZE chunk as it fills, so memory stays at one
+# part no matter how big the object gets. Objects smaller than a part are
+# sent with a single put.
+class _S3MultipartWriter(_StoreWriter):
+    def __init__(self, client, bucket, key, part_size=MULTIPART_PART_SIZE):
+        super().__init__()
+        self.client, self.bucket, self.key = client, bucket, key
+        self.part_size = part_size
+        self._buf = bytearray()
+        self._upload_id = None
+        self._parts = []
+
+    def _write(self, b):
+        self._buf += b
+        while len(self._buf) >= self.part_size:
+            self._upload_part(bytes(self._buf[:self.part_size]))
+            del self._buf[:self.part_size]
+
+    def _upload_part(self, body):
+        if self._upload_id is None:
+            self._upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=self.key)["UploadId"]
+        n = len(self._parts) + 1
+        resp = self.client.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                                       PartNumber=n, Body=body)
+        self._parts.append({"PartNumber": n, "ETag": resp["ETag"]})
+
+    def _commit(self):
+        if self._upload_id is None:
+            self.client.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self._buf))
+            return
+        if self._buf:
+            self._upload_part(bytes(self._buf))
+        self.client.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                                              MultipartUpload={"Parts": self._parts})
+
+    def _abort(self):
+        if self._upload_id is not None:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+
+
+class _LocalFileWriter(_StoreWriter):
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._tmp = path.with_name(f".{path.name}.tmp")
+        self._file = open(self._tmp, "wb")
+
+    def _write(self, b):
+        self._file.write(b)
+
+    def _commit(self):
+        self._file.close()
+        os.replace(self._tmp, self.path)
+
+    def _abort(self):
+        self._file.close()
+        self._tmp.unlink(missing_ok=True)
+
+
+class S3Store(ObjectStore):
+    def __init__(self, client=None, bucket=None):
+        self.client = client or get_s3_client()
+        self.bucket = bucket or get_s3_bucket()
+
+    def get(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=key)["Body"].read()
+
+    def get_range(self, key, start, end):
+        resp = self.client.get_object(Bucket=self.bucket, Key=key, Range=f"bytes={start}-{end - 1}")
+        return resp["Body"].read()
+
+    def put(self, key, body):
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=body)
+
+    def exists(self, key):
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "404":
+                return False
+            raise
+
+    def list(self, prefix):
+        keys = []
+        for page in self.client.get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=prefix):
+            keys.extend(obj["Key"] for obj in page.get("Contents", []))
+        return sorted(keys)
+
+    def stat(self, key):
+        from botocore.exceptions import ClientError
+        try:
+            resp = self.client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "404":
+                return None
+            raise
+        return resp["ETag"], resp["ContentLength"]
+
+    def list_meta(self, prefix):
+        meta = {}
+        for page in self.client.get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=prefix):
+            meta.update((obj["Key"], (obj["ETag"], obj["Size"])) for obj in page.get("Contents", []))
+        return meta
+
+    def download(self, key, path):
+        self.client.download_file(self.bucket, key, str(path))
+
+    def upload(self, path, key):
+        self.client.upload_file(str(path), self.bucket, key)
+
+    def open_writer(self, key):
+        return _S3MultipartWriter(self.client, self.bucket, key)
+
+
+class LocalStore(ObjectStore):
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def _path(self, key):
+        return self.root / key
+
+    def get(self, key):
+        return self._path(key).read_bytes()
+
+    def get_range(self, key, start, end):
+        with open(self._path(key), "rb") as f:
+            f.seek(start)
+            return f.read(end - start)
+
+    def put(self, key, body):
+        if isinstance(body, str):
+            body = body.encode()
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.tmp")
+        tmp.write_bytes(body)
+        os.replace(tmp, path)
+
+    def exists(self, key):
+        return self._path(key).is_file()
+
+    def list(self, prefix):
+        base = self._path(prefix) if prefix.endswith("/") else self._path(prefix).parent
+        if not base.is_dir():
+            return []
+        keys = (p.relative_to(self.root).as_posix() for p in base.rglob("*")
+                if p.is_file() and not p.name.startswith("."))
+        return sorted(k for k in keys if k.startswith(prefix))
+
+    def stat(self, key):
+        try:
+            st = self._path(key).stat()
+        except FileNotFoundError:
+            return None
+        return f"{st.st_mtime_ns:x}-{st.st_size:x}", st.st_size
+
+    def list_meta(self, prefix):
+        return {k: self.stat(k) for k in self.list(prefix)}
+
+    def download(self, key, path):
+        shutil.copyfile(self._path(key), path)
+
+    def upload(self, path, key):
+        dest = self._path(key)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(path, dest)
+
+    def open_writer(self, key):
+        return _LocalFileWriter(self._path(key))
+
+
+# A read-through cache of another store's objects on local disk, for stages
+# that read the same config files and daily objects run after run. Every read
+# is validated against the object's current etag and size, from a listing made
+# earlier in the run if there was one and a HEAD otherwise, so a changed
+# object is always refetched. Only whole-object reads are cached; writes go
+# straight through and drop the cached copy. Each object is a file named by a
+# hash of its key plus a .json of the etag and size it was fetched at; hits
+# bump the file's mtime, and once the cache is over max_bytes the least
+# recently used files are evicted. A copy evicted between the lookup and the
+# read is treated as a miss.
+class CachedStore(ObjectStore):
+    def __init__(self, inner, root, max_bytes=STORE_CACHE_MAX_BYTES):
+        self.inner = inner
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.stats = {"hits": 0, "misses": 0, "stale": 0, "evicted": 0, "bytes_cached": 0, "bytes_fetched": 0}
+        self._listed = {}
+        self._lock = threading.Lock()
+        self._evict_lock = threading.Lock()
+        self._total = sum(p.stat().st_size for p in self.root.glob("*.obj"))
+
+    def _paths(self, key):
+        name = hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+        return self.root / f"{name}.obj", self.root / f"{name}.json"
+
+    def _count(self, **counts):
+        with self._lock:
+            for name, n in counts.items():
+                self.stats[name] += n
+
+    def _forget(self, key):
+        with self._lock:
+            self._listed.pop(key, None)
+        self._paths(key)[1].unlink(missing_ok=True)
+
+    # The object's current (etag, size), and the cached copy's path if it
+    # matches, else None.
+    def _lookup(self, key):
+        with self._lock:
+            meta = self._listed.get(key)
+        meta = meta or self.inner.stat(key)
+        data_path, meta_path = self._paths(key)
+        try:
+            cached = tuple(json.loads(meta_path.read_text()))
+            if meta is not None and cached == tuple(meta) and data_path.stat().st_size == meta[1]:
+                os.utime(data_path)
+                return meta, data_path
+        except (FileNotFoundError, ValueError):
+            cached = None
+        self._count(stale=int(cached is not None), misses=1)
+        return meta, None
+
+    def _fetch(self, key, meta):
+        body = self.inner.get(key)
+        self._count(bytes_fetched=len(body))
+        if meta is None or len(body) != meta[1]:
+            return body
+        data_path, meta_path = self._paths(key)
+        try:
+            replaced = data_path.stat().st_size
+        except FileNotFoundError:
+            replaced = 0
+        suffix = f".{threading.get_ident()}.tmp"
+        tmp = data_path.with_name(data_path.name + suffix)
+        tmp.write_bytes(body)
+        os.replace(tmp, data_path)
+        tmp = meta_path.with_name(meta_path.name + suffix)
+        tmp.write_text(json.dumps(list(meta)))
+        os.replace(tmp, meta_path)
+        with self._lock:
+            self._total += len(body) - replaced
+            over = self._total > self.max_bytes
+        if over:
+            self.evict()
+        return body
+
+    def get(self, key):
+        meta, path = self._lookup(key)
+        if path is not None:
+            try:
+                body = path.read_bytes()
+            except FileNotFoundError:
+                self._count(misses=1)
+            else:
+                self._count(hits=1, bytes_cached=len(body))
+                return body
+        return self._fetch(key, meta)
+
+    def get_range(self, key, start, end):
+        _, path = self._lookup(key)
+        if path is not None:
+            try:
+                with open(path, "rb") as f:
+                    f.seek(start)
+                    body = f.read(end - start)
+            except FileNotFoundError:
+                self._count(misses=1)
+            else:
+                self._count(hits=1, bytes_cached=len(body))
+                return body
+        return self.inner.get_range(key, start, end)
+
+    def put(self, key, body):
+        self._forget(key)
+        self.inner.put(key, body)
+
+    def exists(self, key):
+        return self.inner.exists(key)
+
+    def stat(self, key):
+        return self.inner.stat(key)
+
+    def list_meta(self, prefix):
+        meta = self.inner.list_meta(prefix)
+        with self._lock:
+            self._listed.update(meta)
+        return meta
+
+    def list(self, prefix):
+        return sorted(self.list_meta(prefix))
+
+    def download(self, key, path):
+        meta, cached = self._lookup(key)
+        if cached is not None:
+            try:
+                shutil.copyfile(cached, path)
+            except FileNotFoundError:
+                self._count(misses=1)
+            else:
+                self._count(hits=1, bytes_cached=Path(path).stat().st_size)
+                return
+        Path(path).write_bytes(self._fetch(key, meta))
+
+    def upload(self, path, key):
+        self._forget(key)
+        self.inner.upload(path, key)
+
+    def open_writer(self, key):
+        self._forget(key)
+        return self.inner.open_writer(key)
+
+    def evict(self):
+        with self._evict_lock:
+            self._evict()
+
+    def _evict(self):
+        files = []
+        for path in self.root.glob("*.obj"):
+            try:
+                files.append((path.stat(), path))
+            except FileNotFoundError:
+                continue
+        total = sum(st.st_size for st, _ in files)
+        evicted = 0
+        for st, path in sorted(files, key=lambda f: f[0].st_mtime):
+            if total <= self.max_bytes:
+                break
+            path.with_suffix(".json").unlink(missing_ok=True)
+            path.unlink(missing_ok=True)
+            total -= st.st_size
+            evicted += 1
+        with self._lock:
+            self._total = total
+            self.stats["evicted"] += evicted
+
+    def summary(self):
+        s = self.stats
+        return (f"Store cache: {s['hits']} hits, {s['misses']} misses ({s['stale']} stale), "
+                f"{s['bytes_cached'] / 1024**2:.1f} MiB from cache, {s['bytes_fetched'] / 1024**2:.1f} MiB fetched, "
+                f"{s['evicted']} evicted")
+
+
+# STORE_CACHE_DIR turns on the read-through cache in front of whichever
+# backend is selected, capped at STORE_CACHE_MAX_BYTES (default 20 GiB).
+def get_store():
+    backend = os.environ.get("STORAGE_BACKEND", "s3")
+    if backend == "local":
+        store = LocalStore(os.environ.get("LOCAL_STORE_DIR", DATA_DIR / "store"))
+    elif backend == "s3":
+        store = S3Store()
+    else:
+        raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+    cache_dir = os.environ.get("STORE_CACHE_DIR")
+    if cache_dir:
+        store = CachedStore(store, cache_dir, int(os.environ.get("STORE_CACHE_MAX_BYTES", STORE_CACHE_MAX_BYTES)))
+    return store
@@ -0,0 +1,103 @@
+import numpy as np
+
+# splits.json and dividends_adjusted.json compiled against a symbol list, so
+# the optimizer and backtester adjust whole panels with array ops instead of
+# walking the JSON per symbol.
+#
+# A split entry {symbol: {date: factor}} means prices before midnight UTC of
+# `date` get multiplied by `factor`; with several splits a period gets the
+# product of every factor whose cutoff is still ahead of it.
+
+
+def _ns(dates):
+    return np.asarray(dates, dtype="datetime64[ns]").astype(np.int64)
+
+
+def _days(dates):
+    return np.asarray(dates, dtype="datetime64[D]").astype(np.int64)
+
+
+class Splits:
+    def __init__(self, cols, cutoff_ns, factors):
+        self.cols = np.asarray(cols, dtype=np.int64)
+        self.cutoff_ns = np.asarray(cutoff_ns, dtype=np.int64)
+        self.factors = np.asarray(factors, dtype=np.float64)
+
+    @classmethod
+    def from_json(cls, splits, symbols):
+        sym_to_col = {s: i for i, s in enumerate(symbols)}
+        events = sorted((sym_to_col[sym], str(date)[:10], float(f))
+                        for sym, dates in splits.items() if sym in sym_to_col
+                        for date, f in dates.items())
+        if not events:
+            return cls([], [], [])
+        cols, dates, factors = zip(*events)
+        return cls(cols, _ns(dates), factors)
+
+    # Per-column cumulative adjustment factors at each of `periods_ns`
+    # (sorted), as (cols, factors) where factors is (n_periods, len(cols)) and
+    # cols are the adjusted columns.
+    def factor_matrix(self, periods_ns):
+        cols, k = np.unique(self.cols, return_inverse=True)
+        # Each split scales rows before the first period at or after its
+        # cutoff, so drop its factor on that row and take the product of
+        # everything after each row.
+        first_after = np.searchsorted(periods_ns, self.cutoff_ns, side="left")
+        steps = np.ones((len(periods_ns) + 1, len(cols)), dtype=np.float64)
+        np.multiply.at(steps, (first_after, k), self.factors)
+        factors = np.cumprod(steps[::-1], axis=0)[::-1]
+        return cols, factors[1:]
+
+    # Adjusts a (n_periods, n_symbols) price panel in place.
+    def apply(self, prices, periods_ns):
+        if len(self.cols) == 0:
+            return prices
+        cols, factors = self.factor_matrix(np.asarray(periods_ns, dtype=np.int64))
+        prices[:, cols] = prices[:, cols] * factors
+        return prices
+
+
+# Dividends as one row per (pay date, symbol) entry, in file order, for the
+# symbols in the list: ex and pay dates as days since epoch, column, and
+# per-share amount.
+class Dividends:
+    def __init__(self, ex_day, pay_day, cols, amounts):
+        self.ex_day = np.asarray(ex_day, dtype=np.int64)
+        self.pay_day = np.asarray(pay_day, dtype=np.int64)
+        self.cols = np.asarray(cols, dtype=np.int64)
+        self.amounts = np.asarray(amounts, dtype=np.float64)
+
+    @classmethod
+    def from_json(cls, dividends, symbols):
+        sym_to_col = {s: i for i, s in enumerate(symbols)}
+        rows = [(str(info["ex_date"])[:10], pay_date[:10], sym_to_col[sym], float(info["amount"]))
+                for pay_date, syms in dividends.items()
+                for sym, info in syms.items() if sym in sym_to_col]
+        if not rows:
+            return cls([], [], [], [])
+        ex, pay, cols, amounts = zip(*rows)
+        return cls(_days(ex), _days(pay), cols, amounts)
+
+    # (rows, cols, amounts) placing each dividend on the first of `periods_ns`
+    # that falls on its ex date, dropping those with no period that day.
+    def at_first_period(self, periods_ns):
+        period_days = np.asarray(periods_ns, dtype=np.int64).astype("datetime64[ns]").astype("datetime64[D]").astype(np.int64)
+        rows = np.searchsorted(period_days, self.ex_day, side="left")
+        hit = rows < len(period_days)
+        hit[hit] = period_days[rows[hit]] == self.ex_day[hit]
+        return rows[hit], self.cols[hit], self.amounts[hit]
+
+    # Ex-date events as CSR over `days` (sorted days since epoch): for day d,
+    # entries ex_ptr[d]:ex_ptr[d + 1] hold the column, the per-share amount and
+    # the index of the day it's paid on, or -1 if that isn't a later day in
+    # `days`.
+    def by_day(self, days):
+        days = np.asarray(days, dtype=np.int64)
+        ex = np.searchsorted(days, self.ex_day)
+        on_day = (ex < len(days)) & (days[np.minimum(ex, len(days) - 1)] == self.ex_day)
+        pay = np.searchsorted(days, self.pay_day)
+        paid = (pay < len(days)) & (days[np.minimum(pay, len(days) - 1)] == self.pay_day) & (pay > ex)
+        pay = np.where(paid, pay, -1)
+        order = np.flatnonzero(on_day)[np.argsort(ex[on_day], kind="stable")]
+        ex_ptr = np.searchsorted(ex[order], np.arange(len(days) + 1)).astype(np.int64)
+        return ex_ptr, self.cols[order], self.amounts[order], pay[order]
@@ -0,0 +1,85 @@
+import multiprocessing
+import os
+import resource
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Where a stage's Modal functions run. EXECUTOR=modal (the default) calls them
+# on Modal as before; EXECUTOR=local runs the same function bodies in forked
+# processes on this machine, so a stage can be run on one big Linux host or
+# tested without a Modal account.
+#
+#   executor.map(fn, items, **kwargs)  fn(item, **kwargs) for every item,
+#                                      yielded in completion order
+#   executor.call(fn, *args, **kwargs)  fn(*args, **kwargs), waited for
+#
+# Locally, each item is its own task on a shared queue, so an idle worker
+# picks up the next day as soon as it finishes one rather than days being
+# split up front. Each worker's data segment is capped at the memory the
+# function reserves on Modal (RLIMIT_DATA, so memory-mapped panels don't
+# count), and there are only as many workers as cores and RAM allow. Workers
+# are forked, so they don't re-run the stage script and the shared kwargs
+# (symbology index, sessions, frames) are inherited rather than pickled for
+# every task.
+_job = None
+
+
+class ModalExecutor:
+    def map(self, fn, items, **kwargs):
+        yield from fn.map(items, kwargs=kwargs, order_outputs=False)
+
+    def call(self, fn, *args, **kwargs):
+        return fn.remote(*args, **kwargs)
+
+
+class LocalExecutor:
+    def __init__(self, memory_mb, workers=None):
+        self.memory_mb = memory_mb
+        ram_mb = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // 1024**2
+        self.workers = workers or max(1, min(os.cpu_count(), ram_mb // memory_mb))
+
+    def _pool(self, workers):
+        return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("fork"),
+                                   initializer=_limit_memory, initargs=(self.memory_mb,))
+
+    def map(self, fn, items, **kwargs):
+        global _job
+        _job = (fn, kwargs)
+        with self._pool(self.workers) as pool:
+            for future in as_completed([pool.submit(_run_item, item) for item in items]):
+                yield future.result()
+
+    def call(self, fn, *args, **kwargs):
+        global _job
+        _job = (fn, kwargs)
+        with self._pool(1) as pool:
+            return pool.submit(_run_call, args).result()
+
+
+def _limit_memory(memory_mb):
+    limit = memory_mb * 1024**2
+    resource.setrlimit(resource.RLIMIT_DATA, (limit, limit))
+
+
+# A Modal function's own body, or fn itself if it's a plain function.
+def _local(fn):
+    return getattr(fn, "local", fn)
+
+
+def _run_item(item):
+    fn, kwargs = _job
+    return _local(fn)(item, **kwargs)
+
+
+def _run_call(args):
+    fn, kwargs = _job
+    return _local(fn)(*args, **kwargs)
+
+
+# LOCAL_WORKERS overrides the local worker count.
+def get_executor(memory_mb):
+    backend = os.environ.get("EXECUTOR", "modal")
+    if backend == "local":
+        return LocalExecutor(memory_mb, int(os.environ.get("LOCAL_WORKERS", 0)) or None)
+    if backend == "modal":
+        return ModalExecutor()
+    raise ValueError(f"Unknown EXECUTOR: {backend}")
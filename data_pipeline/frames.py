@@ -0,0 +1,109 @@
+import io
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from config import DATA_DIR, HEIGHT, NUM_PIXELS, WIDTH
+
+# The Bad Apple frames as one contiguous uint8 (n_frames, HEIGHT, WIDTH) array
+# plus the rebalance period each frame is shown at, in a directory:
+#
+#   data/bad_apple_frames/timestamps.npy  int64 ns since epoch, sorted
+#   data/bad_apple_frames/pixels.npy      uint8 (n_frames, HEIGHT, WIDTH), 0-255
+#
+# uint8 is lossless, since frames come out of the video as 8-bit grayscale.
+# Frames that are (close enough to) black and white can instead be stored
+# bit-packed along rows as pixels_bits.npy, uint8 (n_frames, HEIGHT, WIDTH / 8),
+# with every pixel at or above 128 on (255) and the rest off. Opening a uint8
+# store memory-maps the pixels; a bit-packed one is unpacked on open.
+#
+# The old single-file format, a parquet with a timestamp column and one
+# float32 column per pixel (p0..p3071, value / 255), is still read by
+# `Frames.load` and `Frames.from_bytes`.
+FRAMES_DIR = DATA_DIR / "bad_apple_frames"
+LEGACY_FILE = DATA_DIR / "bad_apple_frames.parquet"
+
+
+class Frames:
+    def __init__(self, timestamps, pixels):
+        self.timestamps = np.asarray(timestamps, dtype=np.int64)
+        self.pixels = pixels
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def save(self, path=FRAMES_DIR, bits=False):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for name in ("pixels.npy", "pixels_bits.npy"):
+            (path / name).unlink(missing_ok=True)
+        np.save(path / "timestamps.npy", self.timestamps)
+        if bits:
+            np.save(path / "pixels_bits.npy", np.packbits(np.asarray(self.pixels) >= 128, axis=-1))
+        else:
+            np.save(path / "pixels.npy", np.ascontiguousarray(self.pixels, dtype=np.uint8))
+
+    @classmethod
+    def open(cls, path=FRAMES_DIR):
+        path = Path(path)
+        timestamps = np.load(path / "timestamps.npy")
+        if (path / "pixels_bits.npy").exists():
+            return cls(timestamps, _unpack(np.load(path / "pixels_bits.npy")))
+        return cls(timestamps, np.load(path / "pixels.npy", mmap_mode="r"))
+
+    # The frame store in `path` if there is one, else the old parquet.
+    @classmethod
+    def load(cls, path=FRAMES_DIR, legacy=LEGACY_FILE):
+        if Path(path, "timestamps.npy").exists():
+            return cls.open(path)
+        return cls.from_parquet(legacy)
+
+    @classmethod
+    def from_parquet(cls, source):
+        df = pd.read_parquet(source)
+        timestamps = pd.to_datetime(df["timestamp"], utc=True).values.astype("datetime64[ns]").astype(np.int64)
+        values = df[[f"p{i}" for i in range(NUM_PIXELS)]].to_numpy(dtype=np.float32)
+        pixels = np.rint(values * 255.0).clip(0, 255).astype(np.uint8).reshape(-1, HEIGHT, WIDTH)
+        order = np.argsort(timestamps, kind="stable")
+        return cls(timestamps[order], pixels[order])
+
+    # For shipping frames to a Modal worker in one blob.
+    def to_bytes(self):
+        buf = io.BytesIO()
+        np.savez(buf, timestamps=self.timestamps, pixels=np.asarray(self.pixels))
+        return buf.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        if data[:4] == b"PAR1":
+            return cls.from_parquet(io.BytesIO(data))
+        with np.load(io.BytesIO(data)) as arrays:
+            return cls(arrays["timestamps"], arrays["pixels"])
+
+    def timestamp_index(self):
+        return pd.to_datetime(self.timestamps, unit="ns", utc=True)
+
+    # The frames shown at each of `timestamps_ns`, which must all be frame
+    # timestamps.
+    def at(self, timestamps_ns):
+        rows = np.searchsorted(self.timestamps, np.asarray(timestamps_ns, dtype=np.int64))
+        return Frames(self.timestamps[rows], np.asarray(self.pixels[rows]))
+
+    # Pixel intensities in [0, 1] as float32 (n_frames, NUM_PIXELS), pixel
+    # index row-major (y * WIDTH + x).
+    def values(self):
+        return np.asarray(self.pixels).reshape(len(self), NUM_PIXELS).astype(np.float32) / 255.0
+
+    # Portfolio weights: each frame's intensities divided by its number of lit
+    # pixels (at least 1), so a frame's weights sum to its mean lit intensity.
+    # Returns the (n_frames, NUM_PIXELS) weights and the float32 lit counts.
+    def weights(self):
+        values = self.values()
+        active_counts = (values > 0).sum(axis=1).astype(np.float32)
+        active_counts[active_counts == 0] = 1.0
+        return values / active_counts[:, None], active_counts
+
+
+def _unpack(bits):
+    return np.unpackbits(bits, axis=-1, count=WIDTH).astype(np.uint8) * np.uint8(255)
@@ -0,0 +1,62 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+# Backtest holdings stored piecewise-constant: shares only change at
+# rebalances, so instead of one row per minute there's one row per segment,
+# and segment k holds from minute seg_start[k] up to seg_start[k + 1]. Position
+# values are shares times the 1-min mid, so they aren't stored at all; pass
+# the mids for the range you want to `values`.
+#
+#   minutes    int64 ns since epoch, every valuation minute
+#   symbols    symbol names, the columns of `shares`
+#   seg_start  int64 index into minutes where each segment starts, from 0
+#   shares     float32 (n_segments, n_symbols)
+
+
+class Holdings:
+    def __init__(self, minutes, symbols, seg_start, shares):
+        self.minutes = np.asarray(minutes, dtype=np.int64)
+        self.symbols = [str(s) for s in symbols]
+        self.seg_start = np.asarray(seg_start, dtype=np.int64)
+        self.shares = np.asarray(shares, dtype=np.float32)
+
+    def to_bytes(self):
+        buf = io.BytesIO()
+        np.savez(buf, minutes=self.minutes, symbols=np.array(self.symbols, dtype=str),
+                 seg_start=self.seg_start, shares=self.shares)
+        return buf.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        with np.load(io.BytesIO(data)) as arrays:
+            return cls(arrays["minutes"], arrays["symbols"], arrays["seg_start"], arrays["shares"])
+
+    # Minute positions covered by [start, end], both inclusive timestamps,
+    # either of which can be None for the start/end of the backtest.
+    def _range(self, start, end):
+        lo = 0 if start is None else np.searchsorted(self.minutes, pd.Timestamp(start).as_unit("ns").value)
+        hi = len(self.minutes) if end is None else np.searchsorted(self.minutes, pd.Timestamp(end).as_unit("ns").value, side="right")
+        return lo, hi
+
+    def _index(self, lo, hi):
+        return pd.to_datetime(self.minutes[lo:hi], unit="ns", utc=True)
+
+    def shares_array(self, lo, hi):
+        seg = np.searchsorted(self.seg_start, np.arange(lo, hi), side="right") - 1
+        return self.shares[seg]
+
+    def shares_at(self, start=None, end=None):
+        lo, hi = self._range(start, end)
+        return pd.DataFrame(self.shares_array(lo, hi), index=self._index(lo, hi), columns=self.symbols)
+
+    # `mid` is a DataFrame of 1-min mids (minutes x symbols) covering the
+    # range; it's aligned to the holdings' minutes and symbols, and missing
+    # mids value the position at 0, as the backtest does.
+    def values(self, mid, start=None, end=None):
+        lo, hi = self._range(start, end)
+        index = self._index(lo, hi)
+        mid = mid.reindex(index=index, columns=self.symbols).to_numpy(dtype=np.float64)
+        values = np.nan_to_num(mid * self.shares_array(lo, hi), nan=0.0).astype(np.float32)
+        return pd.DataFrame(values, index=index, columns=self.symbols)
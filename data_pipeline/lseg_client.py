@@ -0,0 +1,326 @@
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# Corporate-action requests go through one of these instead of calling
+# lseg.data directly, so the fetcher can run against a fake service with no
+# credentials: LSEG_CLIENT=fake swaps in FakeLsegClient, which answers with
+# made-up (but deterministic) data and misbehaves like the real thing.
+#
+# get_data(rics, fields, parameters) returns a DataFrame with an "Instrument"
+# column and LSEG's display names for the fields, like ld.get_data.
+MAX_BATCH = 100
+MIN_BATCH = 1
+MAX_RETRIES = 3
+BACKOFF_BASE = 2.0
+BACKOFF_CAP = 60.0
+
+
+class RateLimitError(Exception):
+    def __init__(self, message="Too many requests", retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# lseg.data doesn't have a dedicated rate-limit exception, just the HTTP
+# status in the message.
+def is_rate_limited(e):
+    if isinstance(e, RateLimitError):
+        return True
+    message = str(e).lower()
+    return "429" in message or "too many requests" in message or "rate limit" in message
+
+
+# Errors that mean the request was too big to answer in time, which a smaller
+# batch can get past. Same story for the status codes.
+def is_too_large(e):
+    if isinstance(e, TimeoutError):
+        return True
+    message = str(e).lower()
+    return "413" in message or "too large" in message or "timed out" in message or "timeout" in message
+
+
+class LsegClient(ABC):
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    @abstractmethod
+    def get_data(self, rics, fields, parameters=None):
+        ...
+
+
+class LsegDataClient(LsegClient):
+    def open(self):
+        import lseg.data as ld
+
+        with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as f:
+            json.dump({
+                "sessions": {"platform": {"rdp": {
+                    "app-key": os.getenv("LSEG_APP_KEY") or os.getenv("REFINITIV_API_KEY"),
+                    "username": os.getenv("LSEG_USERNAME") or os.getenv("REFINITIV_USERNAME"),
+                    "password": os.getenv("LSEG_PASSWORD") or os.getenv("REFINITIV_PASSWORD"),
+                    "signon_control": True,
+                }}},
+                "logs": {"level": "warning"},
+            }, f)
+            config_path = f.name
+        ld.load_config(config_path)
+        os.unlink(config_path)
+        ld.open_session(name="platform.rdp")
+
+    def close(self):
+        import lseg.data as ld
+        ld.close_session()
+
+    def get_data(self, rics, fields, parameters=None):
+        import lseg.data as ld
+        return ld.get_data(rics, fields, parameters=parameters)
+
+
+FIELD_COLUMNS = {
+    "TR.CommonName": "Company Common Name",
+    "TR.DivExDate": "Dividend Ex Date",
+    "TR.DivPayDate": "Dividend Pay Date",
+    "TR.DivRecordDate": "Dividend Record Date",
+    "TR.DivUnadjustedGross": "Gross Dividend Amount",
+    "TR.DivAdjustedGross": "Adjusted Gross Dividend Amount",
+    "TR.DivType": "Dividend Type",
+    "TR.DivCurrency": "Dividend Currency",
+    "TR.CAExDate": "Capital Change Ex Date",
+    "TR.CAEffectiveDate": "Capital Change Effective Date",
+    "TR.CAAdjustmentFactor": "Adjustment Factor",
+    "TR.CAAdjustmentType": "Adjustment Type",
+    "TR.CAAnnouncementDate": "Capital Change Announcement Date",
+    "TR.CATermsOldShares": "Terms Old Shares",
+    "TR.CATermsNewShares": "Terms New Shares",
+}
+
+
+# A stand-in LSEG for load tests and CI. Every RIC gets the same answers on
+# every run: most are covered, pay a few quarterly dividends and now and then
+# split. Requests take `latency` plus `per_ric_latency` per RIC, more than
+# `rate` requests a second get a RateLimitError, batches over `max_batch` RICs
+# time out, and `failure_rate` of the rest fail at random.
+class FakeLsegClient(LsegClient):
+    def __init__(self, latency=0.05, per_ric_latency=0.001, rate=20.0, max_batch=MAX_BATCH,
+                 failure_rate=0.0, coverage=0.9, seed=0):
+        self.latency = latency
+        self.per_ric_latency = per_ric_latency
+        self.rate = rate
+        self.max_batch = max_batch
+        self.failure_rate = failure_rate
+        self.coverage = coverage
+        self.seed = seed
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._recent = deque()
+        self.requests = 0
+
+    def _admit(self, n_rics):
+        with self._lock:
+            self.requests += 1
+            now = time.monotonic()
+            while self._recent and self._recent[0] <= now - 1.0:
+                self._recent.popleft()
+            if len(self._recent) >= self.rate:
+                raise RateLimitError(retry_after=self._recent[0] + 1.0 - now)
+            self._recent.append(now)
+            fail = self._random.random() < self.failure_rate
+        time.sleep(self.latency + self.per_ric_latency * n_rics)
+        if n_rics > self.max_batch:
+            raise TimeoutError(f"Request for {n_rics} RICs timed out")
+        if fail:
+            raise ConnectionError("Connection reset by peer")
+
+    def _rng(self, ric, what):
+        return np.random.default_rng(zlib.crc32(f"{self.seed}:{what}:{ric}".encode()))
+
+    def get_data(self, rics, fields, parameters=None):
+        self._admit(len(rics))
+        columns = ["Instrument"] + [FIELD_COLUMNS.get(f, f) for f in fields]
+        if "TR.CommonName" in fields:
+            rows = [[ric, ric.split(".")[0] + " Inc" if self._rng(ric, "cov").random() < self.coverage else None]
+                    for ric in rics]
+        elif "TR.DivExDate" in fields:
+            rows = [row for ric in rics for row in self._dividends(ric)]
+        else:
+            rows = [row for ric in rics for row in self._capital_changes(ric)]
+        df = pd.DataFrame(rows, columns=columns)
+        for col in columns[1:]:
+            if col.endswith("Date"):
+                df[col] = pd.to_datetime(df[col])
+            elif col.endswith(("Amount", "Factor", "Shares")):
+                df[col] = pd.to_numeric(df[col])
+        return df
+
+    def _dividends(self, ric):
+        rng = self._rng(ric, "div")
+        if rng.random() < 0.6:
+            return [[ric] + [None] * 7]
+        amount = round(float(rng.uniform(0.05, 1.5)), 4)
+        first = pd.Timestamp("2020-01-01") + pd.Timedelta(days=int(rng.integers(0, 90)))
+        rows = []
+        for q in range(24):
+            ex = first + pd.DateOffset(months=3 * q)
+            rows.append([ric, ex, ex + pd.Timedelta(days=14), ex + pd.Timedelta(days=1),
+                         amount, amount, "Regular Cash", "USD"])
+        return rows
+
+    def _capital_changes(self, ric):
+        rng = self._rng(ric, "ca")
+        if rng.random() < 0.95:
+            return [[ric] + [None] * 7]
+        old, new = (1, int(rng.integers(2, 11))) if rng.random() < 0.7 else (int(rng.integers(2, 31)), 1)
+        ex = pd.Timestamp("2020-01-01") + pd.Timedelta(days=int(rng.integers(0, 2190)))
+        return [[ric, ex, ex, old / new, "Split" if new > old else "Reverse Split",
+                 ex - pd.Timedelta(days=30), old, new]]
+
+
+def get_lseg_client():
+    backend = os.environ.get("LSEG_CLIENT", "lseg")
+    if backend == "fake":
+        return FakeLsegClient()
+    if backend == "lseg":
+        return LsegDataClient()
+    raise ValueError(f"Unknown LSEG_CLIENT: {backend}")
+
+
+# Runs get_data over `rics` in batches on a bounded pool of threads.
+#
+# Batch size adapts: it starts at `batch_size`, halves whenever a batch is too
+# big to answer (a timeout or payload-too-large, and the batch is split in two
+# and retried), and grows back by a quarter after each success. Any other
+# failure (connection errors, auth, an outage) retries the same batch up to
+# `max_retries` times with exponential backoff, as does a too-big batch already
+# down to MIN_BATCH RICs; after that it's given up on and the RICs it held end
+# up in `failed` until the next fetch.
+#
+# Rate limiting is shared: a rate-limited request pauses every worker until
+# the server's retry-after (or an exponential backoff with jitter, if it
+# didn't say), and the batch goes back on the queue without using a retry.
+class BatchFetcher:
+    def __init__(self, client, workers=8, batch_size=MAX_BATCH, max_retries=MAX_RETRIES, progress=None):
+        self.client = client
+        self.workers = workers
+        self.max_batch = batch_size
+        self.max_retries = max_retries
+        self.progress = progress
+        self.stats = {"requests": 0, "rics": 0, "rate_limited": 0, "retries": 0, "failed": 0, "seconds": 0.0}
+        self._lock = threading.Condition()
+        self._resume_at = 0.0
+        self._limited_streak = 0
+        self.failed = []
+
+    # Returns one DataFrame per batch that came back non-empty, in RIC order.
+    def fetch(self, rics, fields, parameters=None):
+        rics = list(rics)
+        self._queue = deque()
+        self._next = 0
+        self._rics = rics
+        self._in_flight = 0
+        self._batch_size = self.max_batch
+        self._results = []
+        self.failed = []
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for future in [executor.submit(self._work, fields, parameters) for _ in range(self.workers)]:
+                future.result()
+        self.stats["seconds"] += time.monotonic() - started
+        return [df for _, df in sorted(self._results, key=lambda r: r[0])]
+
+    # The next batch as (offset into rics, rics, attempt): a requeued one
+    # first, else the next batch_size RICs. None once everything is done.
+    def _take(self):
+        with self._lock:
+            while True:
+                if self._queue:
+                    task = self._queue.popleft()
+                elif self._next < len(self._rics):
+                    start = self._next
+                    self._next = min(start + self._batch_size, len(self._rics))
+                    task = (start, self._rics[start:self._next], 0)
+                elif self._in_flight:
+                    self._lock.wait()
+                    continue
+                else:
+                    return None
+                self._in_flight += 1
+                return task
+
+    def _done(self, requeue=(), rics_done=0):
+        with self._lock:
+            self._queue.extendleft(reversed(requeue))
+            self._in_flight -= 1
+            self._lock.notify_all()
+        if self.progress is not None and rics_done:
+            self.progress.update(rics_done)
+
+    def _wait_for_rate_limit(self):
+        while (delay := self._resume_at - time.monotonic()) > 0:
+            time.sleep(delay)
+
+    def _work(self, fields, parameters):
+        while (task := self._take()) is not None:
+            start, batch, attempt = task
+            self._wait_for_rate_limit()
+            try:
+                with self._lock:
+                    self.stats["requests"] += 1
+                df = self.client.get_data(batch, fields, parameters)
+            except Exception as e:
+                if is_rate_limited(e):
+                    self._on_rate_limited(e)
+                    self._done([task])
+                    continue
+                self._done(*self._on_failure(task, e))
+                continue
+            with self._lock:
+                self._limited_streak = 0
+                self._batch_size = min(self.max_batch, self._batch_size + max(1, self._batch_size // 4))
+                self.stats["rics"] += len(batch)
+                if df is not None and not df.empty:
+                    self._results.append((start, df))
+            self._done(rics_done=len(batch))
+
+    def _on_rate_limited(self, e):
+        with self._lock:
+            self.stats["rate_limited"] += 1
+            self._limited_streak += 1
+            delay = getattr(e, "retry_after", None)
+            if delay is None:
+                delay = min(BACKOFF_CAP, BACKOFF_BASE ** self._limited_streak) * random.uniform(0.5, 1.0)
+            self._resume_at = max(self._resume_at, time.monotonic() + delay)
+
+    # Returns the _done arguments for a failed batch.
+    def _on_failure(self, task, e):
+        start, batch, attempt = task
+        if is_too_large(e) and len(batch) > MIN_BATCH:
+            with self._lock:
+                self._batch_size = max(MIN_BATCH, min(self._batch_size, len(batch)) // 2)
+            mid = len(batch) // 2
+            return [(start, batch[:mid], 0), (start + mid, batch[mid:], 0)], 0
+        if attempt + 1 < self.max_retries:
+            wait = BACKOFF_BASE ** (attempt + 1)
+            with self._lock:
+                self.stats["retries"] += 1
+            time.sleep(wait)
+            return [(start, batch, attempt + 1)], 0
+        with self._lock:
+            self.stats["failed"] += len(batch)
+            self.failed.extend(batch)
+        (print if self.progress is None else self.progress.write)(
+            f"FAILED {len(batch)} RICs from {batch[0]} after {self.max_retries} retries: {e}")
+        return [], len(batch)
@@ -0,0 +1,162 @@
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from config import STORE_WORKERS
+from partitions import MAX_INFLIGHT_BYTES, iter_days
+from sessions import Sessions
+
+# A panel is one directory per interval holding dense float32 period x symbol
+# matrices as .npy files plus the index sidecars:
+#
+#   panels/15min/mid.npy         float32 (n_periods, n_symbols)
+#   panels/15min/spread_bps.npy  float32 (n_periods, n_symbols)
+#   panels/15min/periods.npy     int64 ns since epoch, sorted
+#   panels/15min/symbols.json    sorted symbol names
+#
+# The 15-min panel keeps only rebalance periods and only symbols quoted (with
+# a non-negative spread) in every one of them, which is the universe both the
+# optimizer and backtester start from. The 1-min panel uses the same symbols
+# and every minute present in the data, with NaN where a symbol had no quote.
+# Opening a panel memory-maps the matrices, so startup is free and the pages
+# are shared between processes reading the same files.
+INTERVALS = ("15min", "1min")
+FIELDS = ("mid", "spread_bps")
+SIDECARS = ("periods.npy", "symbols.json")
+# {file name: store etag} for the local copies in a panel directory, so a
+# fetch can tell which files the store has since replaced.
+ETAGS = "etags.json"
+
+
+class Panel:
+    def __init__(self, path, fields=FIELDS):
+        path = Path(path)
+        self.periods = np.load(path / "periods.npy")
+        self.symbols = json.loads((path / "symbols.json").read_text())
+        self.symbol_to_col = {s: i for i, s in enumerate(self.symbols)}
+        for field in fields:
+            setattr(self, field, np.load(path / f"{field}.npy", mmap_mode="r"))
+
+    def period_index(self):
+        return pd.to_datetime(self.periods, unit="ns", utc=True)
+
+    def columns(self, symbols):
+        return np.array([self.symbol_to_col[s] for s in symbols], dtype=np.int64)
+
+
+def _read_etags(path):
+    try:
+        return json.loads((path / ETAGS).read_text())
+    except FileNotFoundError:
+        return {}
+
+
+# Downloads whatever part of a panel isn't already in dest_dir, or differs
+# from the store's copy, and opens it. Files are swapped in by rename, so
+# anything that still has the old ones memory-mapped keeps reading them.
+def fetch_panel(store, interval, dest_dir, fields=FIELDS):
+    dest = Path(dest_dir) / interval
+    dest.mkdir(parents=True, exist_ok=True)
+    remote = store.list_meta(f"panels/{interval}/")
+    etags = _read_etags(dest)
+    for name in (*SIDECARS, *(f"{field}.npy" for field in fields)):
+        key = f"panels/{interval}/{name}"
+        if key not in remote:
+            raise FileNotFoundError(f"{key} is not in the store; run 5b_build_panels.py")
+        etag = remote[key][0]
+        if etags.get(name) == etag and (dest / name).exists():
+            continue
+        tmp = dest / f".{name}.tmp"
+        store.download(key, tmp)
+        os.replace(tmp, dest / name)
+        etags[name] = etag
+        (dest / ETAGS).write_text(json.dumps(etags))
+    return Panel(dest, fields)
+
+
+# Records the uploaded etags alongside the files, so fetching into the same
+# directory afterwards doesn't download them again.
+def upload_panel(store, interval, src_dir):
+    src = Path(src_dir) / interval
+    etags = {}
+    for name in (*SIDECARS, *(f"{field}.npy" for field in FIELDS)):
+        key = f"panels/{interval}/{name}"
+        store.upload(src / name, key)
+        etags[name] = store.stat(key)[0]
+    (src / ETAGS).write_text(json.dumps(etags))
+
+
+def rebalance_grid(dates):
+    return Sessions.load(min(dates, default=None), max(dates, default=None)).on(dates).rebalance_grid()
+
+
+def _period_ns(df):
+    return df["period"].values.astype("datetime64[ns]").astype(np.int64)
+
+
+def _day_keys(store, interval):
+    return [k for k in store.list(f"bbo_{interval}/") if k.endswith(".parquet")]
+
+
+def _write_panel(store, out, day_keys, day_periods, symbols, **loader):
+    out.mkdir(parents=True, exist_ok=True)
+    # The files no longer match what's in the store until they're uploaded.
+    (out / ETAGS).unlink(missing_ok=True)
+    periods = np.concatenate(day_periods) if day_periods else np.array([], dtype=np.int64)
+    shape = (len(periods), len(symbols))
+    matrices = {field: np.lib.format.open_memmap(out / f"{field}.npy", mode="w+", dtype=np.float32, shape=shape)
+                for field in FIELDS}
+    for m in matrices.values():
+        m[:] = np.nan
+
+    symbol_arr = np.array(symbols, dtype=str)
+    offsets = dict(zip(day_keys, np.cumsum([0] + [len(p) for p in day_periods]).tolist()))
+    grids = dict(zip(day_keys, day_periods))
+    keys = [key for key, grid in grids.items() if len(grid) > 0] if len(symbol_arr) else []
+    for key, table in iter_days(store, keys, ["symbol", "period", *FIELDS], symbols, **loader):
+        grid, offset = grids[key], offsets[key]
+        df = table.to_pandas()
+        ts = _period_ns(df)
+        sym = df["symbol"].to_numpy(dtype=str)
+        col = np.minimum(np.searchsorted(symbol_arr, sym), len(symbol_arr) - 1)
+        row = np.minimum(np.searchsorted(grid, ts), len(grid) - 1)
+        keep = (symbol_arr[col] == sym) & (grid[row] == ts)
+        for field, m in matrices.items():
+            m[offset + row[keep], col[keep]] = df[field].to_numpy(dtype=np.float32)[keep]
+
+    for m in matrices.values():
+        m.flush()
+    np.save(out / "periods.npy", periods)
+    (out / "symbols.json").write_text(json.dumps(list(symbols)))
+
+
+# Day objects are read through partitions.iter_days, `workers` at a time
+# within a `max_bytes` budget.
+def build_panels(store, out_dir, workers=STORE_WORKERS, max_bytes=MAX_INFLIGHT_BYTES):
+    out_dir = Path(out_dir)
+    loader = {"workers": workers, "max_bytes": max_bytes}
+
+    keys_15min = _day_keys(store, "15min")
+    valid = rebalance_grid([k.split("/")[-1].removesuffix(".parquet") for k in keys_15min])
+    day_periods, counts = [], None
+    for _, table in iter_days(store, keys_15min, ["symbol", "period", "spread_bps"], **loader):
+        df = table.to_pandas()
+        ts = _period_ns(df)
+        df = df[(df["spread_bps"].to_numpy() >= 0) & valid.contains(ts)]
+        day_periods.append(np.unique(_period_ns(df)))
+        day_counts = df["symbol"].value_counts()
+        counts = day_counts if counts is None else counts.add(day_counts, fill_value=0)
+    n_periods = sum(len(p) for p in day_periods)
+    symbols = sorted(counts[counts == n_periods].index) if counts is not None else []
+    print(f"15min panel: {n_periods} periods x {len(symbols)} complete symbols")
+    _write_panel(store, out_dir / "15min", keys_15min, day_periods, symbols, **loader)
+
+    keys_1min = _day_keys(store, "1min")
+    day_periods = []
+    for _, table in iter_days(store, keys_1min, ["symbol", "period"], symbols, **loader):
+        day_periods.append(np.unique(_period_ns(table.to_pandas())))
+    print(f"1min panel: {sum(len(p) for p in day_periods)} periods x {len(symbols)} symbols")
+    _write_panel(store, out_dir / "1min", keys_1min, day_periods, symbols, **loader)
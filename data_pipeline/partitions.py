@@ -0,0 +1,70 @@
+import io
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from config import STORE_WORKERS
+
+# Reads a run of daily parquet objects (bbo_15min/2025-01-02.parquet, ...)
+# concurrently but hands them back one at a time in order, so a pass over
+# every day keeps the network and cores busy without holding every day in
+# memory. Up to `workers` days are fetched and decoded ahead of the one being
+# consumed, as long as the bytes in flight stay under `max_bytes`: a day
+# counts its object size while it's being fetched and its decoded size once
+# it's decoded, until the caller moves past it. A day bigger than the budget
+# on its own is still read, just with nothing else in flight.
+MAX_INFLIGHT_BYTES = 2 * 1024**3
+
+
+def _decode(body, columns, symbols):
+    table = pq.read_table(io.BytesIO(body), columns=columns)
+    if symbols is not None:
+        table = table.filter(pc.is_in(table["symbol"], value_set=symbols))
+    return table
+
+
+# Yields (key, pyarrow.Table) for each of `keys` in order, with only
+# `columns` (all if None) and, if `symbols` is given, only rows for those
+# symbols.
+def iter_days(store, keys, columns=None, symbols=None, workers=STORE_WORKERS, max_bytes=MAX_INFLIGHT_BYTES):
+    keys = list(keys)
+    if not keys:
+        return
+    prefix = keys[0].rsplit("/", 1)[0] + "/"
+    sizes = store.list_sizes(prefix)
+    if symbols is not None:
+        symbols = pa.array(sorted(symbols), type=pa.string())
+    if columns is not None and symbols is not None and "symbol" not in columns:
+        raise ValueError("Filtering by symbol needs the symbol column")
+
+    lock = threading.Lock()
+    inflight = [0]
+
+    def load(key, reserved):
+        table = _decode(store.get(key), columns, symbols)
+        with lock:
+            inflight[0] += table.nbytes - reserved
+        return table
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        next_key = 0
+        while next_key < len(keys) or pending:
+            while next_key < len(keys) and len(pending) < workers:
+                size = sizes.get(keys[next_key], 0)
+                with lock:
+                    if pending and inflight[0] + size > max_bytes:
+                        break
+                    inflight[0] += size
+                pending.append((keys[next_key], executor.submit(load, keys[next_key], size)))
+                next_key += 1
+            key, future = pending.popleft()
+            table = future.result()
+            yield key, table
+            with lock:
+                inflight[0] -= table.nbytes
+            del table, future
@@ -0,0 +1,54 @@
+import io
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Writes a results table one trading day at a time, as the simulation
+# finishes each day. Each day becomes one row group of `key`, which is streamed
+# to the store as it grows (multipart on S3) and appears there once the sink
+# is closed. Each day is also put on its own as `<key without .parquet>/<day>.parquet`,
+# so finished days can be read while the run is still going, e.g.
+#
+#   pd.read_parquet(io.BytesIO(store.get("results/backtest_nav/2025-01-02.parquet")))
+
+
+class DaySink:
+    def __init__(self, store, key, schema):
+        self.store = store
+        self.key = key
+        self.days_prefix = key.removesuffix(".parquet") + "/"
+        self._file = store.open_writer(key)
+        self._writer = pq.ParquetWriter(self._file, schema)
+
+    def write_day(self, day, columns):
+        table = pa.table(columns, schema=self._writer.schema)
+        if table.num_rows == 0:
+            return
+        self._writer.write_table(table, row_group_size=table.num_rows)
+        buf = io.BytesIO()
+        pq.write_table(table, buf)
+        self.store.put(f"{self.days_prefix}{day}.parquet", buf.getvalue())
+
+    def close(self):
+        self._writer.close()
+        self._file.close()
+
+    def abort(self):
+        self._writer.close()
+        self._file.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+
+# Arrow schema for a results table with a UTC `period` timestamp column
+# followed by the fields of a numpy structured dtype.
+def period_schema(dtype):
+    return pa.schema([("period", pa.timestamp("ns", tz="UTC"))] +
+                     [(name, pa.from_numpy_dtype(dtype[name])) for name in dtype.names])
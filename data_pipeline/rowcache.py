@@ -0,0 +1,88 @@
+import hashlib
+import os
+from pathlib import Path
+
+import numpy as np
+
+# On-disk cache of per-symbol rows of the optimizer's gross and cost matrices.
+# A row's key is a hash of everything that goes into computing it (that
+# symbol's return and spread series, the frame weights, the narrative
+# multipliers), so a row is reused exactly when its inputs haven't changed and
+# stale rows just stop being looked up until eviction gets to them. Each row is
+# its own .npy file, and hits bump its mtime so eviction is least recently used.
+#
+# Bump CACHE_VERSION whenever the way a row is computed changes.
+CACHE_VERSION = 1
+MAX_BYTES = 4 * 1024**3
+
+
+def fingerprint(*parts):
+    h = hashlib.blake2b(str(CACHE_VERSION).encode(), digest_size=16)
+    for part in parts:
+        if isinstance(part, str):
+            h.update(part.encode())
+        else:
+            part = np.ascontiguousarray(part)
+            h.update(f"{part.dtype}{part.shape}".encode())
+            h.update(part.data)
+    return h.hexdigest()
+
+
+class RowCache:
+    def __init__(self, root, max_bytes=MAX_BYTES):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+    def _path(self, key):
+        return self.root / f"{key}.npy"
+
+    def get_many(self, keys):
+        rows = {}
+        for key in keys:
+            path = self._path(key)
+            try:
+                rows[key] = np.load(path)
+            except (FileNotFoundError, ValueError):
+                continue
+            os.utime(path)
+        return rows
+
+    def put_many(self, rows):
+        for key, row in rows.items():
+            path = self._path(key)
+            tmp = path.with_name(f".{path.name}.tmp")
+            with open(tmp, "wb") as f:
+                np.save(f, row)
+            os.replace(tmp, path)
+        self.evict()
+
+    def evict(self):
+        files = [(p.stat(), p) for p in self.root.glob("*.npy")]
+        total = sum(st.st_size for st, _ in files)
+        for st, path in sorted(files, key=lambda f: f[0].st_mtime):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= st.st_size
+
+
+# Looks up one row per key and computes only the missing ones with
+# compute(missing_positions) -> (len(missing), n) array. Returns the full
+# (len(keys), n) matrix and the number of hits.
+def cached_rows(cache, keys, compute):
+    if not keys:
+        return np.empty((0, 0), dtype=np.float32), 0
+    hits = cache.get_many(keys) if cache is not None else {}
+    missing = [i for i, key in enumerate(keys) if key not in hits]
+    fresh = compute(np.array(missing, dtype=np.int64)) if missing else None
+    if fresh is not None and cache is not None:
+        cache.put_many({keys[i]: fresh[n] for n, i in enumerate(missing)})
+    width = fresh.shape[1] if fresh is not None else len(next(iter(hits.values())))
+    out = np.empty((len(keys), width), dtype=np.float32)
+    for i, key in enumerate(keys):
+        if key in hits:
+            out[i] = hits[key]
+    if missing:
+        out[missing] = fresh
+    return out, len(keys) - len(missing)
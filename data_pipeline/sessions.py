@@ -0,0 +1,152 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+from config import DATA_DIR
+
+# The XNAS session schedule as int64 arrays, built from exchange_calendars
+# once and cached in data/, so nothing downstream has to construct a calendar
+# (slow) or loop over schedule rows. Sessions serialize to a couple hundred
+# KB, so the local entrypoint can hand them to Modal workers instead of every
+# worker building its own calendar. The cache records the exchange_calendars
+# version it was built with and is rebuilt when that changes or when it
+# doesn't cover the dates asked for.
+#
+#   days      int64 days since epoch, one per session, sorted
+#   open_ns   int64 ns since epoch
+#   close_ns  int64 ns since epoch
+CALENDAR = "XNAS"
+CACHE_PATH = DATA_DIR / f"sessions_{CALENDAR}.npz"
+MINUTE_NS = 60 * 1_000_000_000
+REBALANCE_NS = 15 * MINUTE_NS
+
+
+def _days(dates):
+    return np.asarray(dates, dtype="datetime64[D]").astype(np.int64)
+
+
+def _calendar_version():
+    from importlib.metadata import PackageNotFoundError, version
+
+    try:
+        return version("exchange_calendars")
+    except PackageNotFoundError:
+        return ""
+
+
+class Sessions:
+    def __init__(self, days, open_ns, close_ns, version=""):
+        self.days = np.asarray(days, dtype=np.int64)
+        self.open_ns = np.asarray(open_ns, dtype=np.int64)
+        self.close_ns = np.asarray(close_ns, dtype=np.int64)
+        self.version = version
+
+    @classmethod
+    def build(cls):
+        import exchange_calendars as xcals
+
+        schedule = xcals.get_calendar(CALENDAR).schedule
+        return cls(_days(schedule.index.values),
+                   schedule["open"].values.astype("datetime64[ns]").astype(np.int64),
+                   schedule["close"].values.astype("datetime64[ns]").astype(np.int64),
+                   _calendar_version())
+
+    # The full schedule, which must cover start through end (dates or date
+    # strings, either None). Raises ValueError if even a fresh calendar
+    # doesn't, rather than letting later dates silently drop out.
+    @classmethod
+    def load(cls, start=None, end=None, cache=CACHE_PATH):
+        if cache.exists():
+            sessions = cls.from_bytes(cache.read_bytes())
+            installed = _calendar_version()
+            if (not installed or sessions.version == installed) and sessions.covers(start, end):
+                return sessions
+        sessions = cls.build()
+        cache.write_bytes(sessions.to_bytes())
+        if not sessions.covers(start, end):
+            raise ValueError(f"{CALENDAR} calendar ({sessions.labels()[0]} to {sessions.labels()[-1]}) "
+                             f"doesn't cover {start} to {end}")
+        return sessions
+
+    def covers(self, start=None, end=None):
+        if len(self.days) == 0:
+            return start is None and end is None
+        return ((start is None or _days(start) >= self.days[0])
+                and (end is None or _days(end) <= self.days[-1]))
+
+    def to_bytes(self):
+        buf = io.BytesIO()
+        np.savez(buf, days=self.days, open_ns=self.open_ns, close_ns=self.close_ns, version=np.array(self.version))
+        return buf.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        with np.load(io.BytesIO(data)) as arrays:
+            version = str(arrays["version"]) if "version" in arrays else ""
+            return cls(arrays["days"], arrays["open_ns"], arrays["close_ns"], version)
+
+    def __len__(self):
+        return len(self.days)
+
+    def _subset(self, mask):
+        return Sessions(self.days[mask], self.open_ns[mask], self.close_ns[mask], self.version)
+
+    # Sessions from start to end inclusive (dates or date strings, either None).
+    def between(self, start=None, end=None):
+        mask = np.ones(len(self.days), dtype=bool)
+        if start is not None:
+            mask &= self.days >= _days(start)
+        if end is not None:
+            mask &= self.days <= _days(end)
+        return self._subset(mask)
+
+    # Sessions on any of `dates`; dates the market was closed are dropped.
+    def on(self, dates):
+        return self._subset(np.isin(self.days, _days(list(dates))))
+
+    def labels(self):
+        return np.datetime_as_string(self.days.astype("datetime64[D]")).tolist()
+
+    # Every step-spaced boundary from open + first_offset through
+    # close - last_offset inclusive, across all sessions, as one sorted
+    # int64 ns array.
+    def grid(self, step_ns, first_offset_ns=0, last_offset_ns=0):
+        first = self.open_ns + first_offset_ns
+        counts = np.maximum((self.close_ns - last_offset_ns - first) // step_ns + 1, 0)
+        starts = np.repeat(first, counts)
+        k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return Grid(starts + k * step_ns)
+
+    # The rebalance periods: every 15 minutes from 15 minutes after the open
+    # to 15 minutes before the close.
+    def rebalance_grid(self):
+        return self.grid(REBALANCE_NS, REBALANCE_NS, REBALANCE_NS)
+
+    # 1-min boundaries from the open up to but not including the close, which
+    # the 15-min forward-fill grid is every 15th of.
+    def minute_grid(self):
+        return self.grid(MINUTE_NS, 0, MINUTE_NS)
+
+
+# A sorted int64 ns period array with position lookups.
+class Grid:
+    def __init__(self, periods):
+        self.periods = np.asarray(periods, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.periods)
+
+    # Position of each of `ts_ns` in the grid, or -1 where it isn't a period.
+    def index(self, ts_ns):
+        ts_ns = np.asarray(ts_ns, dtype=np.int64)
+        if len(self.periods) == 0:
+            return np.full(ts_ns.shape, -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.periods, ts_ns), len(self.periods) - 1)
+        return np.where(self.periods[pos] == ts_ns, pos, -1)
+
+    def contains(self, ts_ns):
+        return self.index(ts_ns) >= 0
+
+    def timestamps(self):
+        return pd.to_datetime(self.periods, unit="ns", utc=True)
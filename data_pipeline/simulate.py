@@ -0,0 +1,154 @@
+import numpy as np
+
+# The backtest's execution model, run event to event instead of minute to
+# minute. Holdings, cash and pending dividends only change at two kinds of
+# events: the first minute of a trading day (dividends paid, then new ones
+# accrued on ex-date) and rebalance minutes. Between events the state is
+# constant, so every minute of a segment is valued at once with a single
+# matrix-vector product against the 1-min mids.
+#
+# Days are indexed by position in the valuation calendar, and dividends come
+# in as corporate_actions.Dividends.by_day events. A dividend whose pay date
+# isn't a later valuation day is never paid, and sits in pending forever, same
+# as it always has.
+NAV_DTYPE = np.dtype([
+    ("nav", np.float64),
+    ("liquid_nav", np.float64),
+    ("cash", np.float64),
+    ("positions", np.float64),
+    ("pending_dividends", np.float64),
+])
+REBALANCE_DTYPE = np.dtype([
+    ("pre_nav", np.float64),
+    ("post_nav", np.float64),
+    ("pre_liquid_nav", np.float64),
+    ("post_liquid_nav", np.float64),
+    ("pre_cash", np.float64),
+    ("post_cash", np.float64),
+    ("pre_positions", np.float64),
+    ("post_positions", np.float64),
+    ("spread_cost", np.float64),
+    ("active_count", np.int64),
+    ("pending_dividends", np.float64),
+])
+
+
+# First minute of each valuation day, plus the total number of minutes, from
+# an array of per-minute day labels (anything comparable, e.g. "2025-01-02").
+def day_starts(minute_days):
+    minute_days = np.asarray(minute_days)
+    changes = np.flatnonzero(minute_days[1:] != minute_days[:-1]) + 1
+    return np.concatenate([[0], changes, [len(minute_days)]]).astype(np.int64)
+
+
+# Runs the simulation. `reb_minutes` are the valuation-minute indices of the
+# rebalances (sorted), with the matching rows of `reb_mid`, `reb_spread_bps`,
+# `target_weights` and `active_counts`. Returns the per-minute NAV records,
+# per-rebalance records, and the holdings as segment start minutes plus
+# float32 shares per segment (see holdings.py): one segment from minute 0 and
+# one per rebalance. If given, on_day(d, nav, rebalances) is called as soon as
+# day d's records are final.
+def simulate(capital, mid_1min, day_ptr, reb_minutes, reb_mid, reb_spread_bps, target_weights, active_counts,
+             ex_ptr, ex_col, ex_amount, ex_pay_day, on_day=None):
+    nav, rebalances, seg_start, seg_shares = simulate_batch(
+        np.array([capital]), np.ones(1), mid_1min, day_ptr,
+        reb_minutes, reb_mid, reb_spread_bps, target_weights[None], active_counts,
+        ex_ptr, ex_col, ex_amount, ex_pay_day,
+        on_day=None if on_day is None else lambda d, nav, rebalances: on_day(d, nav[0], rebalances[0]),
+    )
+    return nav[0], rebalances[0], seg_start, seg_shares[0]
+
+
+# The same simulation for S scenarios at once, which share the market data and
+# calendar but each have their own starting capital, spread multiplier and
+# target weights (S, n_rebalances, n_symbols). Every piece of state gets a
+# leading scenario axis, so a rebalance is one batched step for all of them.
+# Pass keep_holdings=False to skip the (S, n_segments, n_symbols) holdings.
+def simulate_batch(capital, spread_mult, mid_1min, day_ptr, reb_minutes, reb_mid, reb_spread_bps, target_weights,
+                   active_counts, ex_ptr, ex_col, ex_amount, ex_pay_day, on_day=None, keep_holdings=True):
+    n_minutes, n_symbols = mid_1min.shape
+    n_scenarios = len(capital)
+    n_days = len(day_ptr) - 1
+
+    nav = np.zeros((n_scenarios, n_minutes), dtype=NAV_DTYPE)
+    rebalances = np.zeros((n_scenarios, len(reb_minutes)), dtype=REBALANCE_DTYPE)
+    seg_start = np.concatenate([[0], reb_minutes]).astype(np.int64)
+    seg_shares = np.zeros((n_scenarios, len(seg_start) if keep_holdings else 0, n_symbols), dtype=np.float32)
+
+    events = np.union1d(day_ptr[:-1], reb_minutes)
+    bounds = np.append(events, n_minutes)
+    reb_at = dict(zip(reb_minutes.tolist(), range(len(reb_minutes))))
+    day_at = dict(zip(day_ptr[:-1].tolist(), range(n_days)))
+    day_end_at = dict(zip(day_ptr[1:].tolist(), range(n_days)))
+
+    cash = np.asarray(capital, dtype=np.float64).copy()
+    spread_mult = np.asarray(spread_mult, dtype=np.float64)[:, None]
+    shares = np.zeros((n_scenarios, n_symbols), dtype=np.float64)
+    pending = np.zeros((n_scenarios, n_days + 1), dtype=np.float64)
+    pending_total = np.zeros(n_scenarios)
+
+    for start, stop in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        d = day_at.get(start)
+        if d is not None:
+            cash += pending[:, d]
+            pending[:, d] = 0.0
+            for n in range(ex_ptr[d], ex_ptr[d + 1]):
+                held = shares[:, ex_col[n]]
+                pending[:, ex_pay_day[n]] += np.where(held > 0, held * ex_amount[n], 0.0)
+            pending_total = pending.sum(axis=1)
+
+        k = reb_at.get(start)
+        if k is not None:
+            mid = reb_mid[k]
+            half_spread = reb_spread_bps[k] * spread_mult / 20000.0
+            bids = mid * (1.0 - half_spread)
+            asks = mid * (1.0 + half_spread)
+
+            pre_positions = shares @ mid
+            pre_liquid_nav = cash + pre_positions
+            pre_cash = cash.copy()
+            w_target = target_weights[:, k]
+
+            # A scenario with no target weights liquidates, which is the same
+            # as targeting zero shares everywhere.
+            invest = w_target.sum(axis=1) > 0.0
+            target_shares = np.where(invest[:, None] & (mid > 0), w_target * pre_liquid_nav[:, None] / mid, 0.0)
+            delta = target_shares - shares
+            sells = np.maximum(-delta, 0)
+            buys = np.maximum(delta, 0)
+            sell_proceeds = np.einsum("sn,sn->s", sells, bids)
+            buy_cost = np.einsum("sn,sn->s", buys, asks)
+            cash += sell_proceeds
+            cash -= buy_cost
+            shares = target_shares
+            spread_cost = sells @ mid - sell_proceeds + buy_cost - buys @ mid
+
+            post_positions = shares @ mid
+            if keep_holdings:
+                seg_shares[:, k + 1] = shares
+            r = rebalances[:, k]
+            r["pre_nav"] = pre_liquid_nav + pending_total
+            r["post_nav"] = cash + post_positions + pending_total
+            r["pre_liquid_nav"] = pre_liquid_nav
+            r["post_liquid_nav"] = cash + post_positions
+            r["pre_cash"] = pre_cash
+            r["post_cash"] = cash
+            r["pre_positions"] = pre_positions
+            r["post_positions"] = post_positions
+            r["spread_cost"] = spread_cost
+            r["active_count"] = int(active_counts[k])
+            r["pending_dividends"] = pending_total
+
+        seg_mid = mid_1min[start:stop]
+        positions = shares @ np.where(np.isnan(seg_mid), 0.0, seg_mid).T
+        seg = nav[:, start:stop]
+        seg["positions"] = positions
+        seg["cash"] = cash[:, None]
+        seg["pending_dividends"] = pending_total[:, None]
+        seg["liquid_nav"] = cash[:, None] + positions
+        seg["nav"] = cash[:, None] + positions + pending_total[:, None]
+
+        if on_day is not None and stop in day_end_at:
+            on_day(day_end_at[stop], nav, rebalances)
+
+    return nav, rebalances, seg_start, seg_shares
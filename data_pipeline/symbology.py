@@ -0,0 +1,89 @@
+import io
+from collections import defaultdict
+
+import numpy as np
+
+# Databento symbology flattened into one row per (instrument_id, [d0, d1))
+# interval, sorted by instrument and start date, with the symbol stored as an
+# integer code into the sorted `symbols` array. Overlapping intervals for the
+# same instrument are merged when they agree and rejected when they don't, so
+# every lookup afterwards is a single searchsorted.
+DAY_BITS = 20
+
+
+class SymbologyIndex:
+    def __init__(self, inst_ids, d0, d1, codes, symbols):
+        self.inst_ids = np.asarray(inst_ids, dtype=np.int64)
+        self.d0 = np.asarray(d0, dtype=np.int64)
+        self.d1 = np.asarray(d1, dtype=np.int64)
+        self.codes = np.asarray(codes, dtype=np.int32)
+        self.symbols = np.asarray(symbols, dtype=str)
+        self._keys = (self.inst_ids << DAY_BITS) | self.d0
+
+    @classmethod
+    def from_files(cls, all_symbology_files):
+        intervals = defaultdict(list)
+        for sym_data in all_symbology_files:
+            file_start = sym_data["start_date"][:10]
+            file_end = sym_data["end_date"][:10]
+            for symbol, entries in sym_data.get("result", {}).items():
+                for entry in entries:
+                    d0, d1 = max(entry["d0"], file_start), min(entry["d1"], file_end)
+                    if entry["s"] and d0 < d1:
+                        intervals[int(entry["s"])].append((d0, d1, symbol))
+
+        rows = []
+        for inst_id in sorted(intervals):
+            merged = []
+            for d0, d1, symbol in sorted(intervals[inst_id]):
+                if merged and d0 <= merged[-1][2]:
+                    prev = merged[-1]
+                    if prev[3] != symbol:
+                        if d0 < prev[2]:
+                            raise ValueError(
+                                f"Symbology conflict: instrument {inst_id} on {d0} "
+                                f"maps to both {prev[3]} and {symbol}"
+                            )
+                    else:
+                        prev[2] = max(prev[2], d1)
+                        continue
+                merged.append([inst_id, d0, d1, symbol])
+            rows.extend(merged)
+
+        if not rows:
+            return cls([], [], [], [], [])
+        inst_ids, d0, d1, row_symbols = zip(*rows)
+        symbols, codes = np.unique(np.array(row_symbols, dtype=str), return_inverse=True)
+        return cls(inst_ids, _days(d0), _days(d1), codes, symbols)
+
+    # Returns the symbol code for each (instrument_id, date) pair, or -1 where
+    # the instrument has no symbol on that date. `dates` may be a single date.
+    def lookup(self, inst_ids, dates):
+        inst_ids = np.asarray(inst_ids, dtype=np.int64)
+        days = np.broadcast_to(_days(dates), inst_ids.shape)
+        if len(self.inst_ids) == 0:
+            return np.full(inst_ids.shape, -1, dtype=np.int32)
+        pos = np.searchsorted(self._keys, (inst_ids << DAY_BITS) | days, side="right") - 1
+        clipped = np.maximum(pos, 0)
+        hit = (pos >= 0) & (self.inst_ids[clipped] == inst_ids) & (days < self.d1[clipped])
+        return np.where(hit, self.codes[clipped], -1)
+
+    # Sorted instrument ids with a symbol on `date`, and their symbol codes.
+    def instruments_on(self, date):
+        day = _days(date)
+        active = (self.d0 <= day) & (day < self.d1)
+        return self.inst_ids[active], self.codes[active]
+
+    def to_bytes(self):
+        buf = io.BytesIO()
+        np.savez(buf, inst_ids=self.inst_ids, d0=self.d0, d1=self.d1, codes=self.codes, symbols=self.symbols)
+        return buf.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        with np.load(io.BytesIO(data)) as arrays:
+            return cls(arrays["inst_ids"], arrays["d0"], arrays["d1"], arrays["codes"], arrays["symbols"])
+
+
+def _days(dates):
+    return np.asarray(dates, dtype="datetime64[D]").astype(np.int64)